@@ -0,0 +1,56 @@
+# Helpers shared by the editor's status line and both benchmarks: peak memory,
+# the commit being measured, and JSON reports that later runs can compare against.
+import json
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path, results, **versions):
+    # Results plus what they were measured on; `versions` adds library versions
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        **versions,
+        "platform": platform.platform(),
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+
+def compare(results, baseline_path, key, metric, label, describe):
+    # Prints new / old `metric` for every result that has a matching case (same key) in the baseline
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (new / old {label}):")
+    for r in results:
+        old = baseline.get(key(r))
+        if old and old[metric]:
+            print(f"{describe(r)}: {r[metric] / old[metric]:6.2f}x")
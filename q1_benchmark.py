@@ -0,0 +1,154 @@
+# Headless benchmark for the image editor's hot paths.
+# Drives the same functions ImageEditorApp uses (read_image, apply_op, EditGraph,
+# PreviewPyramid, to_pil) over a matrix of image sizes and dtypes, without Tk.
+#
+#   python q1_benchmark.py --sizes 1 4 16 --dtypes uint8 float32 --output bench.json
+#   python q1_benchmark.py --output new.json --compare bench.json
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import perf_utils
+import q1_image_editor as editor
+
+DTYPES = {"uint8": np.uint8, "uint16": np.uint16, "float32": np.float32}
+
+
+def make_image(megapixels, dtype, seed=0):
+    # Smooth noise with some grain looks more like a photo than white noise
+    w = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(2, h // 64), max(2, w // 64), 3), dtype=np.uint8)
+    img = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 8, img.shape, dtype=np.uint8))
+    if dtype == np.uint16:
+        return img.astype(np.uint16) * 257
+    if dtype == np.float32:
+        return img.astype(np.float32) / 255
+    return img
+
+
+def measure(func, repeat):
+    # Wall time for every run; peak traced memory and surviving allocations for the first one
+    times = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    t0 = time.perf_counter()
+    result = func()
+    times.append(time.perf_counter() - t0)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, "filename"))
+    del result
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return {
+        "wall_ms_median": statistics.median(times) * 1000,
+        "wall_ms_min": min(times) * 1000,
+        "peak_mb": peak / (1024 * 1024),
+        "alloc_blocks": blocks,
+    }
+
+
+def bench_undo_redo(img):
+    # Five edits, then undo and redo all of them, evaluating pixels each time like the UI does
+    graph = editor.EditGraph(img)
+    for op in [("grayscale",), ("blur", 15), ("rotate", 90), ("blur", 15), ("rotate", 90)]:
+        graph.push(op)
+        graph.evaluate()
+    while graph.undo():
+        graph.evaluate()
+    while graph.redo():
+        graph.evaluate()
+
+
+def bench_canvas(img):
+    # What a canvas refresh does: fit for the left canvas, 1:1 window for the right one
+    pyramid = editor.PreviewPyramid(img)
+    editor.to_pil(pyramid.fit(600, 400))
+    editor.to_pil(pyramid.viewport(1.0, 600, 400))
+
+
+def bench_blur_preview(pyramid):
+    # One live-preview frame of the blur slider at a small, medium and very large size.
+    # The pyramid is built beforehand, as the editor keeps it per image version.
+    for ksize in (15, 101, 301):
+        editor.blur_preview(pyramid, ksize, editor.CANVAS_WIDTH, editor.CANVAS_HEIGHT)
+
+
+def case_key(r):
+    return r["op"], r["megapixels"], r["dtype"]
+
+
+def describe(r):
+    return f"{r['op']:>10} {r['megapixels']:>5} MP {r['dtype']:>8}"
+
+
+def run_case(megapixels, dtype_name, repeat, scratch_dir):
+    img = make_image(megapixels, DTYPES[dtype_name])
+    if editor.is_large(img):
+        img = editor.to_scratch(img)  # Same backend the editor would use
+    h, w = img.shape[:2]
+    path = os.path.join(scratch_dir, f"bench_{megapixels}_{dtype_name}.tiff")
+    cv2.imwrite(path, img)
+
+    pyramid = editor.PreviewPyramid(img)
+    bench_blur_preview(pyramid)
+    cases = {
+        # Decode at the file's own depth, or uint16/float32 rows would time an 8-bit decode
+        "load": lambda: editor.read_image(path, cv2.IMREAD_UNCHANGED),
+        "grayscale": lambda: editor.apply_op(img, ("grayscale",)),
+        "blur": lambda: editor.apply_op(img, ("blur", 15)),
+        "rotate": lambda: editor.apply_op(img, ("rotate", 90)),
+        "crop": lambda: editor.apply_op(img, ("crop", w // 4, h // 4, 3 * w // 4, 3 * h // 4)),
+        "resize": lambda: editor.apply_op(img, ("resize", 50)),
+        "undo_redo": lambda: bench_undo_redo(img),
+        "canvas": lambda: bench_canvas(img),
+        "blur_preview": lambda: bench_blur_preview(pyramid),
+    }
+    results = []
+    for name, func in cases.items():
+        stats = measure(func, repeat)
+        stats.update(op=name, megapixels=megapixels, dtype=dtype_name, width=w, height=h)
+        results.append(stats)
+        print(f"{describe(stats)}: {stats['wall_ms_median']:9.1f} ms  peak {stats['peak_mb']:8.1f} MB")
+    os.remove(path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image editor operations")
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 4, 16, 100],
+                        help="image sizes in megapixels")
+    parser.add_argument("--dtypes", nargs="+", choices=DTYPES, default=["uint8"])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per operation")
+    parser.add_argument("--output", default="q1_benchmark.json", help="JSON results file")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for megapixels in args.sizes:
+            for dtype_name in args.dtypes:
+                results.extend(run_case(megapixels, dtype_name, args.repeat, scratch_dir))
+
+    perf_utils.write_report(args.output, results, opencv=cv2.__version__)
+    if args.compare:
+        perf_utils.compare(results, args.compare, case_key, "wall_ms_median",
+                           "median wall time", describe)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,974 @@
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
+
+# OpenCV refuses to decode images over 2^30 pixels unless told otherwise
+os.environ.setdefault("OPENCV_IO_MAX_IMAGE_PIXELS", str(2 ** 40))
 import cv2
 import numpy as np
-import copy
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from perf_utils import peak_rss_mb
+
+# Default memory budget for memoized edit results (raw and compressed)
+HISTORY_BUDGET_BYTES = 256 * 1024 * 1024
+# Once the history is over budget, older results are zlib-compressed except for
+# this many of the most recently used ones
+HOT_RESULTS = 2
+# Resize slider ticks closer together than this are coalesced into one preview
+RESIZE_DEBOUNCE_MS = 30
+# How often the Tk thread checks whether the resize worker has finished
+RESIZE_POLL_MS = 10
+# Images at least this big are kept in memory-mapped scratch files and processed in tiles
+TILED_THRESHOLD_BYTES = 256 * 1024 * 1024
+TILE_SIZE = 1024  # Must be even so pyramid levels can be built tile by tile
+# Where scratch files for large images go (defaults to the system temp directory)
+SCRATCH_DIR = os.environ.get("IMAGE_EDITOR_SCRATCH")
+# Blur preview paths: exact separable Gaussian below this sigma, box filters above it,
+# and a blurred pyramid level above the second threshold
+BOX_BLUR_MIN_SIGMA = 6
+PYRAMID_BLUR_MIN_SIGMA = 24
+BLUR_MAX_KSIZE = 301
+# Session journals (edit log + keyframes) let a file's history survive restarts and crashes
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".image_editor", "sessions")
+JOURNAL_KEYFRAME_INTERVAL = 4  # Every Nth edit's result is written to disk
+JOURNAL_SESSION_BUDGET_BYTES = 512 * 1024 * 1024  # Disk space for one session's keyframes
+JOURNAL_MAX_SESSIONS = 20  # Older sessions are deleted when a new one is opened, unless in use
+SESSION_LOCK_FILE = "lock"  # Holds the pid of the editor that has the session open
+# Images with a longer side than this are edited on a downscaled proxy
+PROXY_MAX_SIDE = 2048
+# How often the Tk thread checks on a background save
+SAVE_POLL_MS = 50
+# Decode, filter and encode jobs for all open images share one thread pool
+WORKER_THREADS = os.cpu_count() or 4
+WORKER_POLL_MS = 15
+CANVAS_WIDTH, CANVAS_HEIGHT = 600, 400
+
+
+def colour_mode(img):
+    # Grayscale images are stored as 2-D arrays, colour ones as 3-channel BGR
+    return "gray" if img.ndim == 2 else "bgr"
+
+
+# Image operations shared by the editor buttons and the edit graph.
+# An operation is a tuple: (name, *args)
+def op_grayscale(img):
+    # Grayscale images keep a single channel; see colour_mode()
+    if colour_mode(img) == "gray":
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def op_blur(img, ksize=15):
+    # Exact Gaussian, used for committed edits; blur_preview() is the interactive version
+    return cv2.GaussianBlur(img, (ksize, ksize), 0)
+
+
+def op_rotate(img, angle=90):
+    codes = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180,
+             270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+    angle %= 360
+    if angle == 0:
+        return img.copy()
+    return cv2.rotate(img, codes[angle])
+
+
+def op_crop(img, x0, y0, x1, y1):
+    # Copy so the result doesn't keep the (possibly much larger) parent alive
+    return np.array(img[y0:y1, x0:x1])
+
+
+def op_resize(img, percent=100):
+    w = max(1, int(img.shape[1] * percent / 100))
+    h = max(1, int(img.shape[0] * percent / 100))
+    return cv2.resize(img, (w, h))
+
+
+OPERATIONS = {
+    "grayscale": op_grayscale,
+    "blur": op_blur,
+    "rotate": op_rotate,
+    "crop": op_crop,
+    "resize": op_resize,
+}
+
+
+def apply_op(img, op):
+    name, *args = op
+    if is_large(img) and name in TILED_OPERATIONS:
+        return TILED_OPERATIONS[name](img, *args)
+    return OPERATIONS[name](img, *args)
+
+
+# Out-of-core backend: large images live in memory-mapped scratch files and
+# operations stream over them tile by tile, so RAM use is bounded by the tile size
+def is_large(img):
+    return img.nbytes >= TILED_THRESHOLD_BYTES
+
+
+def new_image(shape, dtype=np.uint8):
+    if int(np.prod(shape)) * np.dtype(dtype).itemsize < TILED_THRESHOLD_BYTES:
+        return np.empty(shape, dtype)
+    # The temporary file is deleted as soon as the mapping is released
+    return np.memmap(tempfile.TemporaryFile(dir=SCRATCH_DIR), dtype=dtype,
+                     mode="w+", shape=shape)
+
+
+def tiles(height, width, size=TILE_SIZE):
+    for y0 in range(0, height, size):
+        for x0 in range(0, width, size):
+            yield y0, min(y0 + size, height), x0, min(x0 + size, width)
+
+
+def to_scratch(img):
+    out = new_image(img.shape, img.dtype)
+    for y0 in range(0, img.shape[0], TILE_SIZE):
+        out[y0:y0 + TILE_SIZE] = img[y0:y0 + TILE_SIZE]
+    return out
+
+
+def read_image(path, flags=cv2.IMREAD_COLOR):
+    img = cv2.imread(path, flags)
+    # Decoding needs one full-size buffer; after that the image is kept on scratch storage
+    if img is not None and is_large(img):
+        img = to_scratch(img)
+    return img
+
+
+# Interactive blur: the blur slider previews with the cheapest path that looks the
+# same on screen; only the committed edit uses the exact GaussianBlur above
+def blur_sigma(ksize):
+    # The sigma OpenCV derives for GaussianBlur when sigma is 0
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+
+def blur_path(sigma):
+    if sigma < BOX_BLUR_MIN_SIGMA:
+        return "gaussian"  # Separable kernel, cheap while the kernel is small
+    if sigma < PYRAMID_BLUR_MIN_SIGMA:
+        return "box"  # Three box passes, cost independent of the radius
+    return "pyramid"  # Blur a downscaled level and upsample
+
+
+def box_blur(img, sigma, passes=3):
+    # Repeated box filters converge to a Gaussian; box widths chosen so the variance matches
+    ideal = (12 * sigma * sigma / passes + 1) ** 0.5
+    lower = int(ideal) - (1 - int(ideal) % 2)
+    upper = lower + 2
+    m = round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes)
+              / (-4 * lower - 4))
+    for i in range(passes):
+        size = lower if i < m else upper
+        img = cv2.blur(img, (size, size))
+    return img
+
+
+def blur_preview(pyramid, ksize, width, height):
+    # Blurred top-left width x height window of pyramid.source (what the right canvas shows).
+    # Only the window plus a halo of the kernel radius is filtered, so the cost does not
+    # depend on the image size; the top/left edges are image borders so no halo is needed there.
+    sigma = blur_sigma(ksize)
+    path = blur_path(sigma)
+    h, w = pyramid.source.shape[:2]
+    out_w, out_h = min(width, w), min(height, h)
+    k = 0
+    if path == "pyramid":
+        while sigma / 2 ** (k + 1) >= PYRAMID_BLUR_MIN_SIGMA / 4 and w >> (k + 1) > 0 and h >> (k + 1) > 0:
+            k += 1
+    level = pyramid.level(k)
+    level_sigma = sigma / 2 ** k
+    halo = ksize // 2 if path == "gaussian" else int(3 * level_sigma) + 1
+    view_w = -(-out_w // 2 ** k)
+    view_h = -(-out_h // 2 ** k)
+    region = level[:view_h + halo, :view_w + halo]
+    if path == "gaussian":
+        blurred = cv2.GaussianBlur(region, (ksize, ksize), 0)
+    else:
+        blurred = box_blur(region, level_sigma)
+    blurred = blurred[:view_h, :view_w]
+    if k:
+        blurred = cv2.resize(blurred, (view_w * 2 ** k, view_h * 2 ** k),
+                             interpolation=cv2.INTER_LINEAR)[:out_h, :out_w]
+    return blurred
+
+
+def tiled_grayscale(img):
+    if colour_mode(img) == "gray":
+        return img
+    out = new_image(img.shape[:2], img.dtype)
+    for y0, y1, x0, x1 in tiles(*img.shape[:2]):
+        out[y0:y1, x0:x1] = op_grayscale(img[y0:y1, x0:x1])
+    return out
+
+
+def tiled_blur(img, ksize=15):
+    # Each tile is read with a halo of half the kernel so seams match a full-image blur
+    h, w = img.shape[:2]
+    halo = ksize // 2
+    out = new_image(img.shape, img.dtype)
+    for y0, y1, x0, x1 in tiles(h, w):
+        hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, h)
+        hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, w)
+        blurred = op_blur(img[hy0:hy1, hx0:hx1], ksize)
+        out[y0:y1, x0:x1] = blurred[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+    return out
+
+
+def tiled_rotate(img, angle=90):
+    # Rotate every tile on its own and write it to its transposed position
+    h, w = img.shape[:2]
+    angle %= 360
+    shape = (w, h) + img.shape[2:] if angle in (90, 270) else img.shape
+    out = new_image(shape, img.dtype)
+    for y0, y1, x0, x1 in tiles(h, w):
+        tile = op_rotate(img[y0:y1, x0:x1], angle)
+        if angle == 90:
+            out[x0:x1, h - y1:h - y0] = tile
+        elif angle == 180:
+            out[h - y1:h - y0, w - x1:w - x0] = tile
+        elif angle == 270:
+            out[w - x1:w - x0, y0:y1] = tile
+        else:
+            out[y0:y1, x0:x1] = tile
+    return out
+
+
+def tiled_crop(img, x0, y0, x1, y1):
+    return to_scratch(img[y0:y1, x0:x1])
+
+
+def tiled_resize(img, percent=100):
+    # OpenCV streams the source from the mapping and writes straight into the output
+    w = max(1, int(img.shape[1] * percent / 100))
+    h = max(1, int(img.shape[0] * percent / 100))
+    out = new_image((h, w) + img.shape[2:], img.dtype)
+    cv2.resize(img, (w, h), dst=out)
+    return out
+
+
+def tiled_halve(img):
+    # Half-size INTER_AREA copy built from even-sized tiles, used for preview levels
+    h, w = img.shape[:2]
+    out = new_image((max(1, h // 2), max(1, w // 2)) + img.shape[2:], img.dtype)
+    for y0, y1, x0, x1 in tiles(h - h % 2, w - w % 2):
+        out[y0 // 2:y1 // 2, x0 // 2:x1 // 2] = cv2.resize(
+            img[y0:y1, x0:x1], ((x1 - x0) // 2, (y1 - y0) // 2),
+            interpolation=cv2.INTER_AREA)
+    return out
+
+
+TILED_OPERATIONS = {
+    "grayscale": tiled_grayscale,
+    "blur": tiled_blur,
+    "rotate": tiled_rotate,
+    "crop": tiled_crop,
+    "resize": tiled_resize,
+}
+
+
+def map_rect(rect, width, height, ops):
+    # Follow a rectangle (x0, y0, x1, y1) on a width x height image through the ops,
+    # clamping it to the image after each one. Returns the rectangle in the final
+    # image's pixels, or None if nothing of it is left.
+    x0, y0, x1, y1 = rect
+    w, h = width, height
+    for name, *args in ops:
+        if name == "rotate":
+            angle = args[0] % 360
+            if angle == 90:
+                x0, y0, x1, y1, w, h = h - y1, x0, h - y0, x1, h, w
+            elif angle == 180:
+                x0, y0, x1, y1 = w - x1, h - y1, w - x0, h - y0
+            elif angle == 270:
+                x0, y0, x1, y1, w, h = y0, w - x1, y1, w - x0, h, w
+        elif name == "crop":
+            cx0, cy0, cx1, cy1 = args
+            w, h = max(0, min(cx1, w) - cx0), max(0, min(cy1, h) - cy0)
+            x0, y0, x1, y1 = x0 - cx0, y0 - cy0, x1 - cx0, y1 - cy0
+        elif name == "resize":
+            nw, nh = max(1, int(w * args[0] / 100)), max(1, int(h * args[0] / 100))
+            x0, x1 = x0 * nw / w, x1 * nw / w
+            y0, y1 = y0 * nh / h, y1 * nh / h
+            w, h = nw, nh
+        x0, x1 = min(max(x0, 0), w), min(max(x1, 0), w)
+        y0, y1 = min(max(y0, 0), h), min(max(y1, 0), h)
+    rect = tuple(int(round(c)) for c in (x0, y0, x1, y1))
+    if rect[2] <= rect[0] or rect[3] <= rect[1]:
+        return None
+    return rect
+
+
+def scale_op(op, scale):
+    # Express an operation recorded at full resolution for an image scaled by `scale`
+    if scale == 1:
+        return op
+    if op[0] == "crop":
+        return ("crop", *(int(round(c * scale)) for c in op[1:]))
+    if op[0] == "blur":
+        return ("blur", max(1, int(round(op[1] * scale))) | 1)  # Kernel size must stay odd
+    return op
+
+
+def fuse_ops(ops):
+    # Merge or cancel adjacent operations that have a cheaper equivalent
+    fused = []
+    for op in ops:
+        prev = fused[-1] if fused else None
+        if op[0] == "rotate" and op[1] % 360 == 0:
+            continue
+        if prev is None or prev[0] != op[0]:
+            fused.append(op)
+        elif op[0] == "rotate":
+            angle = (prev[1] + op[1]) % 360
+            fused.pop()
+            if angle:
+                fused.append(("rotate", angle))
+        elif op[0] == "grayscale":
+            continue  # Grayscale of a grayscale image changes nothing
+        elif op[0] == "crop":
+            px0, py0, px1, py1 = prev[1:]
+            x0, y0, x1, y1 = op[1:]
+            fused[-1] = ("crop", px0 + x0, py0 + y0,
+                         min(px1, px0 + x1), min(py1, py0 + y1))
+        else:
+            fused.append(op)
+    return fused
+
+
+def compress_frame(img):
+    # Horizontal delta filter (like PNG's "Sub" filter) makes photos compress much better.
+    # Only integer data wraps around exactly, so floats are stored unfiltered.
+    delta = img.copy()
+    if np.issubdtype(img.dtype, np.integer):
+        delta[:, 1:] -= img[:, :-1]
+    return zlib.compress(delta.tobytes(), 1), img.shape, img.dtype
+
+
+def decompress_frame(frame):
+    data, shape, dtype = frame
+    delta = np.frombuffer(zlib.decompress(data), dtype=dtype).reshape(shape)
+    if not np.issubdtype(dtype, np.integer):
+        return delta.copy()
+    return np.cumsum(delta, axis=1, dtype=dtype)
+
+
+def frame_nbytes(value):
+    # Size of a memoized result, raw or compressed
+    return value.nbytes if isinstance(value, np.ndarray) else len(value[0])
+
+
+class EditNode:
+    __slots__ = ("op", "parent", "depth", "serial")
+
+    def __init__(self, op, parent, serial):
+        self.op = op
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.serial = serial  # Creation order, used to name the node in the journal
+
+
+# On-disk journal of one image's edit session: a log of every push/undo/redo plus
+# periodic keyframes, so reopening the file (even after a crash) restores its history
+class SessionJournal:
+    def __init__(self, directory, keyframe_interval=JOURNAL_KEYFRAME_INTERVAL,
+                 budget_bytes=JOURNAL_SESSION_BUDGET_BYTES):
+        self.directory = directory
+        self.keyframe_interval = keyframe_interval
+        self.budget_bytes = budget_bytes
+        self.log_path = os.path.join(directory, "ops.jsonl")
+        self.lock_path = os.path.join(directory, SESSION_LOCK_FILE)
+        self.log_file = None
+        self.replaying = False
+        self.error = None  # Set once the journal has been turned off
+        self.keyframes = {}  # Serial -> memory-mapped array, opened lazily
+        os.makedirs(directory, exist_ok=True)
+        # While the lock file names a running editor, pruning (from any process) keeps the session
+        with open(self.lock_path, "w") as f:
+            f.write(str(os.getpid()))
+        os.utime(directory)  # Most recently used sessions survive pruning
+        self.lock = threading.Lock()  # Keyframes are written from pool threads
+        self.saved = {}  # Serial -> keyframe size in bytes
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith("kf_") and name.endswith(".npy"):
+                self.saved[int(name[3:-4])] = os.path.getsize(path)
+            elif name.endswith(".tmp"):
+                os.remove(path)  # Left behind by a crash mid-write
+
+    @classmethod
+    def for_image(cls, path, variant="", root=JOURNAL_DIR):
+        # Keyed on the file's path, size and mtime, so a changed file starts a new session
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{variant}"
+        # Pruning and locking the new session happen together, so documents opening
+        # on other threads can't delete each other's sessions
+        with sessions_lock:
+            prune_sessions(root, JOURNAL_MAX_SESSIONS - 1)
+            return cls(os.path.join(root, hashlib.sha1(key.encode()).hexdigest()))
+
+    def log(self, action, **data):
+        # Appended to ops.jsonl and flushed on every change; replaying it needs no pixel work
+        if self.replaying or self.error is not None:
+            return
+        try:
+            if self.log_file is None:
+                self.log_file = open(self.log_path, "a")
+            self.log_file.write(json.dumps({"action": action, **data}) + "\n")
+            self.log_file.flush()
+        except OSError as e:
+            self.fail(e)
+
+    def fail(self, error):
+        # The edit is already in memory; stop journaling rather than lose it, and delete
+        # the session, since a partial log would restore the wrong history
+        self.error = error
+        self.saved.clear()
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def restore(self, graph):
+        # Rebuild the graph's nodes, head and redo stack from the log
+        if not os.path.exists(self.log_path):
+            return False
+        self.replaying = True
+        good = 0  # End of the last complete entry
+        try:
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn last line from a crash
+                    if not line.endswith(b"\n"):
+                        break  # Also torn, even if it happens to parse
+                    good += len(line)
+                    if entry["action"] == "push":
+                        graph.push(tuple(entry["edit"]), entry["serial"])
+                    elif entry["action"] == "undo":
+                        graph.undo()
+                    elif entry["action"] == "redo":
+                        graph.redo()
+        finally:
+            self.replaying = False
+        # Cut off a torn tail, or new entries would be appended to it and lost on the next replay
+        if good < os.path.getsize(self.log_path):
+            try:
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(good)
+            except OSError as e:
+                self.fail(e)
+        self.keep_keyframes(graph.reachable_serials())  # In case a crash left some behind
+        return graph.head is not None or graph.can_redo()
+
+    def keyframe_path(self, serial):
+        return os.path.join(self.directory, f"kf_{serial}.npy")
+
+    def has_keyframe(self, serial):
+        return serial in self.saved
+
+    def keyframe(self, serial):
+        if serial not in self.saved:
+            return None
+        if serial not in self.keyframes:
+            try:
+                self.keyframes[serial] = np.load(self.keyframe_path(serial), mmap_mode="r")
+            except (OSError, ValueError):
+                self.saved.pop(serial, None)  # Missing or half-written file
+                return None
+        return self.keyframes[serial]
+
+    @property
+    def keyframe_bytes(self):
+        return sum(self.saved.values())
+
+    def maybe_write_keyframe(self, node, image):
+        # Every keyframe_interval-th edit is saved as a .npy that is memory-mapped when needed,
+        # so undo far back reads from disk instead of keeping every frame in RAM
+        if (self.error is not None or (node.depth + 1) % self.keyframe_interval
+                or node.serial in self.saved or image.nbytes > self.budget_bytes):
+            return
+        # Write to a temporary name first so a crash never leaves a truncated keyframe
+        # (per thread, as pool threads may finish the same node at once)
+        path = self.keyframe_path(node.serial)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, image)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Keyframes only save time; without one the node is recomputed when needed
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            self.saved[node.serial] = os.path.getsize(path)
+            # Over budget: the oldest edits are the least likely to be undone to
+            while self.keyframe_bytes > self.budget_bytes:
+                self.remove_keyframe(min(self.saved))
+
+    def remove_keyframe(self, serial):
+        # Caller holds self.lock
+        self.saved.pop(serial, None)
+        self.keyframes.pop(serial, None)
+        try:
+            os.remove(self.keyframe_path(serial))
+        except OSError:
+            pass  # Still mapped (Windows) or already gone; pruning the session removes it
+
+    def keep_keyframes(self, serials):
+        # Delete keyframes of nodes that are not in `serials`
+        with self.lock:
+            for serial in [s for s in self.saved if s not in serials]:
+                self.remove_keyframe(serial)
+
+    def close(self):
+        if self.log_file is not None:
+            try:
+                self.log_file.close()
+            except OSError:
+                pass
+            self.log_file = None
+        self.keyframes.clear()
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+
+# Serialises pruning with opening sessions within this process
+sessions_lock = threading.Lock()
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name != "posix":
+        return True  # No cheap check; the lock is cleared when that session is reopened and closed
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists but belongs to another user
+    return True
+
+
+def session_in_use(directory):
+    try:
+        with open(os.path.join(directory, SESSION_LOCK_FILE)) as f:
+            return pid_alive(int(f.read()))
+    except (OSError, ValueError):
+        return False  # No lock file (or a torn one): nobody has it open
+
+
+def prune_sessions(root, keep):
+    if not os.path.isdir(root):
+        return
+    sessions = sorted((os.path.join(root, name) for name in os.listdir(root)),
+                      key=os.path.getmtime, reverse=True)
+    for old in sessions[keep:]:
+        if not session_in_use(old):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+# Non-destructive edit pipeline for one source image: edits are a chain of nodes
+# that is only evaluated when pixels are needed, with results memoized within a byte budget
+class EditGraph:
+    def __init__(self, source, budget_bytes=HISTORY_BUDGET_BYTES, hot_results=HOT_RESULTS,
+                 scale=1.0, journal=None):
+        self.source = source
+        # Ops are recorded at full resolution; when `source` is a downscaled proxy,
+        # `scale` is its size relative to the original and ops are scaled to match
+        self.scale = scale
+        self.journal = journal  # Optional; logs every change, and its keyframes act as memoized results
+        self.next_serial = 0
+        self.budget_bytes = budget_bytes
+        self.hot_results = hot_results
+        self.head = None  # None means the unedited source
+        self.redo_stack = []
+        self.memo = OrderedDict()  # Node -> array or compressed frame, oldest first
+        self.memo_bytes = 0
+        self.lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        # A running total, so the Tk thread can read it without waiting for the lock
+        return self.memo_bytes
+
+    def put(self, node, value):
+        # Caller holds self.lock. Replacing a value keeps its place in the LRU order.
+        old = self.memo.get(node)
+        if old is not None:
+            self.memo_bytes -= frame_nbytes(old)
+        self.memo[node] = value
+        self.memo_bytes += frame_nbytes(value)
+
+    def discard(self, node):
+        # Caller holds self.lock
+        self.memo_bytes -= frame_nbytes(self.memo.pop(node))
+
+    def ops(self, node=None):
+        node = self.head if node is None else node
+        chain = []
+        while node is not None:
+            chain.append(node.op)
+            node = node.parent
+        return chain[::-1]
+
+    def push(self, op, serial=None):
+        serial = self.next_serial if serial is None else serial
+        self.next_serial = max(self.next_serial, serial + 1)
+        abandoned = bool(self.redo_stack)
+        self.head = EditNode(op, self.head, serial)
+        self.redo_stack.clear()
+        if self.journal is not None:
+            self.journal.log("push", edit=list(op), serial=serial)
+            if abandoned and not self.journal.replaying:
+                # The undone branch can't be redone any more; restore() tidies up after a replay
+                self.journal.keep_keyframes(self.reachable_serials())
+        return self.head
+
+    def reachable_serials(self):
+        # Nodes undo or redo can still get to: the deepest redo entry and its ancestors
+        node = self.redo_stack[0] if self.redo_stack else self.head
+        serials = set()
+        while node is not None:
+            serials.add(node.serial)
+            node = node.parent
+        return serials
+
+    def can_undo(self):
+        return self.head is not None
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        # Undo and redo only move the head; pixels are evaluated when next needed
+        if not self.can_undo():
+            return False
+        self.redo_stack.append(self.head)
+        self.head = self.head.parent
+        if self.journal is not None:
+            self.journal.log("undo")
+        return True
+
+    def redo(self):
+        if not self.can_redo():
+            return False
+        self.head = self.redo_stack.pop()
+        if self.journal is not None:
+            self.journal.log("redo")
+        return True
+
+    def evaluate(self, node=None):
+        # Safe to call from worker threads: the memo is only touched under the lock;
+        # pixel work, compression and keyframe writes all run outside it.
+        # Starts from the nearest memoized ancestor (or the source) and applies the ops
+        # in between fused, so e.g. four rotations cost nothing.
+        node = self.head if node is None else node
+        chain = []
+        base = node
+        image = None
+        with self.lock:
+            while base is not None and base not in self.memo:
+                if self.journal is not None:
+                    image = self.journal.keyframe(base.serial)
+                    if image is not None:
+                        break
+                chain.append(base.op)
+                base = base.parent
+            if image is None and base is not None:
+                value = self.memo[base]
+                self.memo.move_to_end(base)
+        if image is None and base is None:
+            image = self.source
+        elif image is None:
+            image = value
+            if not isinstance(value, np.ndarray):
+                image = decompress_frame(value)
+                with self.lock:
+                    # Keep the frame raw again only if that fits the budget, so stepping
+                    # through old history doesn't compress something else on every read
+                    if (self.memo.get(base) is value
+                            and self.nbytes - len(value[0]) + image.nbytes <= self.budget_bytes):
+                        self.put(base, image)
+        for op in fuse_ops(chain[::-1]):
+            image = apply_op(image, scale_op(op, self.scale))
+        if node is not None:
+            self.store(node, image)
+        return image
+
+    def head_shape(self):
+        # Shape of the current result if it is already known, without evaluating anything
+        if self.head is None:
+            return self.source.shape
+        value = self.memo.get(self.head)
+        if value is None:
+            return None
+        return value.shape if isinstance(value, np.ndarray) else value[1]
+
+    def store(self, node, image):
+        # Called without self.lock, which is only held for the bookkeeping
+        if self.journal is not None:
+            self.journal.maybe_write_keyframe(node, image)
+        with self.lock:
+            self.put(node, image)
+            self.memo.move_to_end(node)
+            victims = self.trim_plan()
+        # Compressed frames still take some space, so keep going while that leaves
+        # the history over budget and there are raw frames left to compress
+        while victims:
+            for old, value in victims:
+                frame = compress_frame(value)
+                with self.lock:
+                    if self.memo.get(old) is value:  # Not replaced or evicted meanwhile
+                        self.put(old, frame)
+            with self.lock:
+                victims = self.trim_plan()
+        # Everything can be replayed from the source, so the oldest results can go
+        with self.lock:
+            while len(self.memo) > 1 and self.memo_bytes > self.budget_bytes:
+                self.discard(next(iter(self.memo)))
+
+    def trim_plan(self):
+        # Caller holds self.lock. Nothing happens while the history fits its budget;
+        # past it, the oldest results are left to the journal or picked for compression.
+        projected = self.memo_bytes
+        victims = []
+        for old in list(self.memo)[:-self.hot_results]:
+            if projected <= self.budget_bytes:
+                break
+            value = self.memo[old]
+            if self.journal is not None and self.journal.has_keyframe(old.serial):
+                self.discard(old)  # Can be mapped back from the journal
+                projected -= frame_nbytes(value)
+            elif isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+                # Scratch-backed results are already on disk, compressing them would load them into RAM
+                victims.append((old, value))
+                projected -= value.nbytes
+        return victims
+
+    def report(self):
+        undo = self.head.depth + 1 if self.head is not None else 0
+        return (f"History: {undo} undo / {len(self.redo_stack)} redo, "
+                f"{len(self.memo)} cached ({self.nbytes / (1024 * 1024):.1f} MB)")
+
+
+def to_pil(img):
+    # Display boundary: PIL and Tk show single-channel images directly as mode "L"
+    if img.dtype == np.uint16:
+        img = cv2.convertScaleAbs(img, alpha=255 / 65535)
+    elif img.dtype != np.uint8:
+        img = cv2.convertScaleAbs(img, alpha=255)  # Floats are expected in [0, 1]
+    if colour_mode(img) == "gray":
+        return Image.fromarray(img)
+    return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+
+# Mip-map style stack of downscaled copies of one image version; the canvases render
+# from the closest level, so a refresh only touches canvas-sized data
+class PreviewPyramid:
+    def __init__(self, image):
+        self.source = image
+        self.levels = [image]
+        self.lock = threading.Lock()  # Levels may be built from the resize worker thread
+
+    def level(self, k):
+        # Level k is the source halved k times, built on first use
+        with self.lock:
+            while len(self.levels) <= k:
+                prev = self.levels[-1]
+                if is_large(prev):
+                    self.levels.append(tiled_halve(prev))
+                    continue
+                size = (max(1, prev.shape[1] // 2), max(1, prev.shape[0] // 2))
+                self.levels.append(cv2.resize(prev, size, interpolation=cv2.INTER_AREA))
+            return self.levels[k]
+
+    def fit(self, width, height):
+        # Whole image stretched to width x height, from the smallest level that is still big enough
+        k = 0
+        h, w = self.source.shape[:2]
+        while w >> (k + 1) >= width and h >> (k + 1) >= height:
+            k += 1
+        return cv2.resize(self.level(k), (width, height), interpolation=cv2.INTER_AREA)
+
+    def viewport(self, scale, width, height, exact=False):
+        # Top-left width x height window of the image scaled by `scale`.
+        # `exact` resamples from full resolution instead of the closest level.
+        h, w = self.source.shape[:2]
+        out_w = min(width, int(w * scale))
+        out_h = min(height, int(h * scale))
+        if out_w <= 0 or out_h <= 0:
+            return None
+        k = 0
+        while (not exact and scale * 2 ** (k + 1) <= 1
+               and w >> (k + 1) > 0 and h >> (k + 1) > 0):
+            k += 1
+        level = self.level(k)
+        rel = scale * 2 ** k  # Scale relative to the chosen level
+        src_w = min(level.shape[1], int(np.ceil(out_w / rel)))
+        src_h = min(level.shape[0], int(np.ceil(out_h / rel)))
+        region = level[:src_h, :src_w]
+        if region.shape[1] == out_w and region.shape[0] == out_h:
+            return region
+        interpolation = cv2.INTER_AREA if exact and rel < 1 else cv2.INTER_LINEAR
+        return cv2.resize(region, (out_w, out_h), interpolation=interpolation)
+
+
+# Optional per-action timing and memory probe for the editor; spans can be exported
+# in the Chrome trace event format (chrome://tracing, Perfetto)
+class Instrumentation:
+    def __init__(self, trace_memory=True):
+        self.events = []
+        self.t0 = time.perf_counter()
+        self.listeners = []  # Called with every finished event
+        self.depth = threading.local()
+        self.trace_memory = trace_memory
+        self.lock = threading.Lock()
+        self.active_threads = set()  # Threads with a span open
+        self.thread_starts = 0  # Counts threads going from no open span to one
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def span(self, name, context=None):
+        depth = getattr(self.depth, "value", 0)
+        me = threading.get_ident()
+        # tracemalloc counts for the whole process, so memory figures are only recorded
+        # for spans that had it to themselves: no other thread had a span open meanwhile
+        with self.lock:
+            if depth == 0:
+                self.active_threads.add(me)
+                self.thread_starts += 1
+            alone = self.active_threads == {me}
+            starts = self.thread_starts
+            if self.trace_memory and alone:
+                if depth == 0:
+                    tracemalloc.reset_peak()
+                mem_before = tracemalloc.get_traced_memory()[0]
+        self.depth.value = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.depth.value = depth
+            args = {"latency_ms": round(duration * 1000, 3)}
+            with self.lock:
+                if self.trace_memory and alone and self.thread_starts == starts:
+                    current, peak = tracemalloc.get_traced_memory()
+                    args["allocated_bytes"] = current - mem_before
+                    args["peak_bytes"] = peak - mem_before
+                if depth == 0:
+                    self.active_threads.discard(me)
+            if context is not None:
+                args.update(context())
+            event = {
+                "name": name, "ph": "X", "pid": os.getpid(),
+                "tid": me,
+                "ts": (start - self.t0) * 1e6, "dur": duration * 1e6, "args": args,
+            }
+            self.events.append(event)
+            for listener in self.listeners:
+                listener(event)
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def instrumented(method):
+    # Wraps an ImageEditorApp method in an instrumentation span when profiling is on
+    # Metrics describe the document the method works on, if it is passed one
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        document = next((a for a in args if isinstance(a, Document)), None)
+        with self.span(method.__name__, document):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# One open image: its original, edit graph and cached previews
+class Document:
+    def __init__(self, path, original_image):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.original_image = original_image
+        self.original_pyramid = PreviewPyramid(original_image)
+        self.graph = None
+        self.pyramid = None  # Preview pyramid of the latest evaluated result
+        self.original_preview = None  # PIL image for the left canvas
+        self.preview = None  # (node, PIL image) for the right canvas
+        self.render_future = None
+        self.save_progress = (0, 1)
+
+    def close(self):
+        if self.graph.journal is not None:
+            self.graph.journal.close()
 
 
 class ImageEditorApp:
-    def __init__(self, root):
+    def __init__(self, root, history_budget=HISTORY_BUDGET_BYTES, instrumentation=None,
+                 journal_dir=JOURNAL_DIR):
         self.root = root
         self.root.title("Image Editor App")
-        self.root.geometry("1200x600")
+        self.root.geometry("1200x650")
         self.root.config(bg="White")  # Set background to white
 
-        self.original_image = None
-        self.display_image = None
+        self.documents = []  # Open images, in tab order
+        self.opening = set()  # Normalised paths being decoded on the pool
+        self.document = None  # The one being shown and edited
+        self.history_budget = history_budget
+        self.journal_dir = journal_dir  # None disables session journals
         self.tk_image = None
-        self.cropped_image = None
-        self.undo_stack = []
-        self.redo_stack = []
+        self.refresh_pending = False
+        self.pending_action = None
+        self.latency = {}  # Action -> last latency in ms
+        self.instrumentation = instrumentation
+
+        # Decode, filter evaluation, resize previews and encode all share one pool;
+        # OpenCV releases the GIL, so the threads really run in parallel
+        self.pool = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+
+        # Only the newest resize preview is shown
+        self.resize_job = None  # Pending debounced after() call
+        self.resize_future = None
+        self.resize_generation = 0
 
         # UI Components
-        self.canvas = tk.Canvas(root, bg="#9E9E9E", width=600, height=400)
+        # One tab per open image
+        self.tabs = ttk.Notebook(root)
+        self.tabs.grid(row=0, column=0, columnspan=2, sticky="we", padx=10)
+        self.tabs.bind("<<NotebookTabChanged>>", self.switch_document)
+
+        self.canvas = tk.Canvas(root, bg="#9E9E9E", width=CANVAS_WIDTH, height=CANVAS_HEIGHT)
         # Left side canvas for original image
-        self.canvas.grid(row=0, column=0, padx=10, pady=10)
+        self.canvas.grid(row=1, column=0, padx=10, pady=10)
 
         self.cropped_canvas = tk.Canvas(
-            root, bg="#9E9E9E", width=600, height=400)
+            root, bg="#9E9E9E", width=CANVAS_WIDTH, height=CANVAS_HEIGHT)
         # Right side canvas for edited image
-        self.cropped_canvas.grid(row=0, column=1, padx=10, pady=10)
+        self.cropped_canvas.grid(row=1, column=1, padx=10, pady=10)
 
         self.canvas.bind("<ButtonPress-1>", self.start_crop)
         self.canvas.bind("<B1-Motion>", self.draw_crop)
@@ -36,7 +976,7 @@ class ImageEditorApp:
 
         # Button styling
         button_frame = tk.Frame(root, bg="white")
-        button_frame.grid(row=1, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=2, column=0, columnspan=2, pady=10)
 
         self.create_button(button_frame, "Load Image", self.load_image)
         self.create_button(button_frame, "Save Image", self.save_image)
@@ -51,9 +991,35 @@ class ImageEditorApp:
         self.slider = tk.Scale(root, from_=10, to=300, orient=tk.HORIZONTAL,
                                label="Resize %", command=self.resize_image)
         self.slider.set(100)
-        self.slider.grid(row=2, column=0, columnspan=2, padx=10, pady=10)
+        self.slider.bind("<ButtonRelease-1>", self.finish_resize)
+        self.slider.grid(row=3, column=0, padx=10, pady=10)
+
+        # Blur size slider: previews live while dragging, the Blur button applies it
+        self.blur_slider = tk.Scale(root, from_=1, to=BLUR_MAX_KSIZE, resolution=2,
+                                    orient=tk.HORIZONTAL, length=300,
+                                    label="Blur size (preview, Blur applies)",
+                                    command=self.preview_blur)
+        self.blur_slider.set(15)
+        self.blur_slider.grid(row=3, column=1, padx=10, pady=10)
+        self.blur_future = None
+        self.blur_generation = 0
+
+        # Status line for history size, undo/redo latency and peak memory
+        self.status = tk.Label(root, text="", anchor="w", bg="white")
+        self.status.grid(row=4, column=0, sticky="we", padx=10)
+        self.save_bar = ttk.Progressbar(root, length=300, mode="determinate")
+        self.save_bar.grid(row=4, column=1, sticky="e", padx=10)
+
+        # Live per-action metrics, only shown when instrumentation is enabled
+        if instrumentation is not None:
+            self.metrics = tk.Label(root, text="", anchor="w", bg="white", fg="#555555")
+            self.metrics.grid(row=5, column=0, columnspan=2, sticky="we", padx=10)
+            instrumentation.listeners.append(self.show_metrics)
+            root.bind("<Control-e>", lambda e: self.export_trace())
 
         # Keyboard shortcuts
+        root.bind("<Control-o>", lambda e: self.load_image())
+        root.bind("<Control-w>", lambda e: self.close_document())
         root.bind("<Control-s>", lambda e: self.save_image())
         root.bind("<Control-z>", lambda e: self.undo())
         root.bind("<Control-y>", lambda e: self.redo())
@@ -61,46 +1027,242 @@ class ImageEditorApp:
 
         self.start_x = self.start_y = self.rect = None
 
+    @property
+    def graph(self):
+        return self.document.graph if self.document is not None else None
+
+    @property
+    def original_image(self):
+        return self.document.original_image if self.document is not None else None
+
+    def span(self, name, document=None):
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.span(
+            name, functools.partial(self.metrics_context, document))
+
+    def metrics_context(self, document=None):
+        # Only looks at what is already computed, so profiling never forces an evaluation.
+        # Without a document, UI actions describe the selected one; pool jobs report none.
+        if document is None and threading.current_thread() is threading.main_thread():
+            document = self.document
+        graph = document.graph if document is not None else None
+        if graph is None:
+            return {}
+        context = {
+            "history_bytes": graph.nbytes,
+            "history_depth": graph.head.depth + 1 if graph.head else 0,
+        }
+        shape = graph.head_shape()
+        if shape is not None:
+            context.update(width=shape[1], height=shape[0])
+        return context
+
+    def show_metrics(self, event):
+        if threading.current_thread() is not threading.main_thread():
+            return  # Tk may only be touched from the main thread
+        args = event["args"]
+        text = f"{event['name']}: {args['latency_ms']:.1f} ms"
+        if "allocated_bytes" in args:
+            text += (f", {args['allocated_bytes'] / (1024 * 1024):+.1f} MB allocated"
+                     f" (peak {args['peak_bytes'] / (1024 * 1024):.1f} MB)")
+        if "width" in args:
+            text += f", {args['width']}x{args['height']}"
+        if "history_depth" in args:
+            text += (f", history {args['history_depth']} edits"
+                     f" / {args['history_bytes'] / (1024 * 1024):.1f} MB")
+        self.metrics.config(text=text)
+
+    def export_trace(self, path=None):
+        if path is None:
+            path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                filetypes=[("Chrome trace", "*.json")])
+        if path:
+            self.instrumentation.export_chrome_trace(path)
+
     def create_button(self, frame, text, command):
         btn = tk.Button(frame, text=text, command=command, font=(
             'Arial', 12, 'bold'), bg="#1E90FF", fg="white", relief="raised", bd=5, height=2, width=12)
         btn.grid(row=0, column=frame.grid_size()[0], padx=5, pady=5)
 
-    def update_canvas_with_image(self, img, canvas):
-        image_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(image_rgb)
+    def when_done(self, future, callback, poll_ms=WORKER_POLL_MS):
+        # Calls callback(future) on the Tk thread once the pool has finished the job
+        if future.done():
+            if not future.cancelled():
+                callback(future)
+            return
+        self.root.after(poll_ms, self.when_done, future, callback, poll_ms)
+
+    def show_on_canvas(self, pil_img, canvas):
+        canvas.delete("image")
+        if pil_img is None:
+            return
         tk_img = ImageTk.PhotoImage(pil_img)
-        canvas.create_image(0, 0, anchor=tk.NW, image=tk_img)
+        canvas.create_image(0, 0, anchor=tk.NW, image=tk_img, tags="image")
+        canvas.tag_lower("image")  # Keep the crop rectangle on top
         canvas.image = tk_img  # Keep a reference to the image
 
+    @instrumented
     def load_image(self):
-        path = filedialog.askopenfilename()
-        if path:
-            self.original_image = cv2.imread(path)
-            self.display_image = self.original_image.copy()
-            self.undo_stack.clear()
-            self.update_canvas()
+        paths = filedialog.askopenfilenames()
+        # Decoding runs on the pool; the first file is shown, the rest open in background tabs.
+        # A file that is already open (or opening) just gets its tab selected: two tabs
+        # would share one session journal and overwrite each other's log and keyframes.
+        for i, path in enumerate(paths):
+            key = os.path.normcase(os.path.abspath(path))
+            open_paths = [os.path.normcase(os.path.abspath(d.path)) for d in self.documents]
+            if key in open_paths:
+                if i == 0:
+                    self.tabs.select(open_paths.index(key))
+                    self.switch_document()
+                continue
+            if key in self.opening:
+                continue
+            self.opening.add(key)
+            future = self.pool.submit(self.open_document, path)
+            self.when_done(future, functools.partial(self.add_document, path, i == 0))
+
+    @instrumented
+    def open_document(self, path):
+        # Runs on the pool: decode, set up the edit graph and prefetch both previews
+        original = read_image(path)
+        if original is None:
+            raise ValueError("could not decode image")
+        # Large images are edited on a proxy; save_image replays the edits at full size
+        k = 0
+        while max(original.shape[:2]) >> k > PROXY_MAX_SIDE:
+            k += 1
+        journal = None
+        if self.journal_dir is not None:
+            try:
+                journal = SessionJournal.for_image(path, f"proxy{k}", self.journal_dir)
+            except OSError:
+                journal = None  # Journals are optional; edit without one
+        document = Document(path, original)
+        document.graph = EditGraph(document.original_pyramid.level(k), self.history_budget,
+                                   scale=0.5 ** k, journal=journal)
+        if journal is not None:
+            journal.restore(document.graph)
+        document.original_preview = to_pil(
+            document.original_pyramid.fit(CANVAS_WIDTH, CANVAS_HEIGHT))
+        document.preview = self.render_preview(document, document.graph.head)
+        return document
+
+    def add_document(self, path, select, future):
+        self.opening.discard(os.path.normcase(os.path.abspath(path)))
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror("Load Failed", f"{path}: {error}")
+            return
+        document = future.result()
+        self.documents.append(document)
+        self.tabs.add(ttk.Frame(self.tabs, height=0), text=document.name)
+        if select or self.document is None:
+            self.tabs.select(len(self.documents) - 1)
+            self.switch_document()
 
+    @instrumented
+    def switch_document(self, event=None):
+        # Shows the cached previews straight away; only a stale right preview is re-rendered
+        if not self.documents:
+            return
+        self.cancel_previews()
+        self.document = self.documents[self.tabs.index("current")]
+        if self.rect:
+            self.canvas.delete(self.rect)
+            self.rect = None
+        self.update_canvas()
+        preview = self.document.preview
+        if preview is not None and preview[0] is self.graph.head:
+            self.show_on_canvas(preview[1], self.cropped_canvas)
+        else:
+            self.schedule_refresh("switch")
+        self.update_status()
+
+    def cancel_previews(self):
+        # Resize and blur previews in flight are for the document and edit that were
+        # showing; once either changes they must not reach the right canvas
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+            self.resize_job = None
+        self.resize_generation += 1
+        self.blur_generation += 1
+        for future in (self.resize_future, self.blur_future):
+            if future is not None:
+                future.cancel()
+
+    def close_document(self):
+        if self.document is None:
+            return
+        self.cancel_previews()
+        index = self.documents.index(self.document)
+        self.documents.pop(index).close()
+        self.document = None
+        self.tabs.forget(index)
+        if self.documents:
+            self.switch_document()
+        else:
+            self.canvas.delete("image")
+            self.cropped_canvas.delete("image")
+            self.update_status()
+
+    @instrumented
     def update_canvas(self):
-        if self.display_image is not None:
-            image = cv2.cvtColor(self.display_image, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(image)
-            image = image.resize((600, 400))
-            self.tk_image = ImageTk.PhotoImage(image)
-            self.canvas.create_image(0, 0, anchor="nw", image=self.tk_image)
+        document = self.document
+        if document is not None:
+            if document.original_preview is None:
+                document.original_preview = to_pil(
+                    document.original_pyramid.fit(CANVAS_WIDTH, CANVAS_HEIGHT))
+            self.tk_image = ImageTk.PhotoImage(document.original_preview)
+            self.canvas.delete("image")
+            self.canvas.create_image(0, 0, anchor="nw", image=self.tk_image, tags="image")
+            self.canvas.tag_lower("image")
 
+    @instrumented
     def save_image(self):
-        if self.cropped_image is not None:
-            image_to_save = self.cropped_image
-        elif self.display_image is not None:
-            image_to_save = self.display_image
-        else:
+        if self.graph is None:
             messagebox.showwarning("No Image", "There is no image to save.")
             return
 
         path = filedialog.asksaveasfilename(defaultextension=".jpg")
         if path:
-            cv2.imwrite(path, image_to_save)
+            document = self.document
+            document.save_progress = (0, 1)
+            future = self.pool.submit(self.render_and_save, document, document.graph.head, path)
+            self.when_done(future, functools.partial(self.finish_save, document), SAVE_POLL_MS)
+            self.show_save_progress(document, future)
+
+    @instrumented
+    def render_and_save(self, document, node, path):
+        # Runs on the pool: replay the edits at full resolution, then encode
+        if document.graph.scale == 1:
+            # Not a proxy: the edited result is already full size
+            image, ops = document.graph.evaluate(node), []
+        else:
+            image, ops = document.original_image, fuse_ops(document.graph.ops(node))
+        total = len(ops) + 1
+        for i, op in enumerate(ops):
+            document.save_progress = (i, total)
+            image = apply_op(image, op)
+        document.save_progress = (len(ops), total)
+        if not cv2.imwrite(path, image):
+            raise IOError(f"Could not write {path}")
+        document.save_progress = (total, total)
+
+    def show_save_progress(self, document, future):
+        if future.done():
+            self.save_bar["value"] = 0
+            return
+        if document is self.document:
+            done, total = document.save_progress
+            self.save_bar["value"] = 100 * done / total
+        self.root.after(SAVE_POLL_MS, self.show_save_progress, document, future)
+
+    def finish_save(self, document, future):
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror("Save Failed", f"{document.name}: {error}")
+        else:
             messagebox.showinfo("Saved", "Image saved successfully!")
 
     def start_crop(self, event):
@@ -118,76 +1280,323 @@ class ImageEditorApp:
     def end_crop(self, event):
         pass  # Crop coordinates are handled in the crop button action
 
+    @instrumented
     def crop_image(self):
-        if self.display_image is None or not self.rect:
+        if self.graph is None or not self.rect:
             return
         # Get the cropping coordinates
         x0, y0, x1, y1 = self.canvas.coords(self.rect)
         x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+        x0, x1 = sorted((max(x0, 0), max(x1, 0)))
+        y0, y1 = sorted((max(y0, 0), max(y1, 0)))
 
         # Ensure proper coordinates for cropping
         if x1 - x0 > 10 and y1 - y0 > 10:
-            self.push_undo()
-            self.cropped_image = self.display_image[y0:y1, x0:x1]
-            self.update_canvas_with_image(
-                self.cropped_image, self.cropped_canvas)
+            # The rectangle is drawn over the original stretched to fill the canvas
+            # (see update_canvas), but the crop applies to the current edit, so it is
+            # followed through the edits so far; ops are in full-resolution pixels
+            h, w = self.original_image.shape[:2]
+            sx, sy = w / CANVAS_WIDTH, h / CANVAS_HEIGHT
+            rect = map_rect((x0 * sx, y0 * sy, x1 * sx, y1 * sy), w, h, self.graph.ops())
+            if rect is None:
+                messagebox.showwarning("Crop", "The selection is outside the edited image.")
+                return
+            self.apply_edit(("crop", *rect))
 
     def resize_image(self, value):
-        if self.display_image is None:
+        # Slider ticks only (re)start a short timer; the preview is rendered once it settles
+        if self.graph is None:
+            return
+        self.resize_generation += 1  # Anything already queued or running is now stale
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(
+            RESIZE_DEBOUNCE_MS, self.start_resize, int(value), False)
+
+    @instrumented
+    def finish_resize(self, event=None):
+        # Slider released: render the final preview from full resolution
+        if self.graph is None:
+            return
+        self.resize_generation += 1
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.start_resize(int(self.slider.get()), True)
+
+    def start_resize(self, value, exact):
+        self.resize_job = None
+        if self.resize_future is not None:
+            self.resize_future.cancel()
+        document = self.document
+        if document is None:
             return
-        scale = int(value) / 91.0
-        w = int(self.display_image.shape[1] * scale)
-        h = int(self.display_image.shape[0] * scale)
-        resized = cv2.resize(self.display_image, (w, h))
-        self.update_canvas_with_image(resized, self.cropped_canvas)
+        self.resize_future = self.pool.submit(
+            self.render_resize, document, document.graph.head, value / 91.0, exact,
+            self.resize_generation)
+        self.when_done(self.resize_future, self.show_resize, RESIZE_POLL_MS)
+
+    @instrumented
+    def render_resize(self, document, node, scale, exact, generation):
+        # Runs on the pool, so it must not touch Tk
+        if generation != self.resize_generation:
+            return None  # Superseded before it started
+        view = self.pyramid_for(document, node).viewport(
+            scale, CANVAS_WIDTH, CANVAS_HEIGHT, exact)
+        return generation, None if view is None else to_pil(view)
+
+    def show_resize(self, future):
+        result = future.result()
+        if result is not None and result[0] == self.resize_generation:
+            self.show_on_canvas(result[1], self.cropped_canvas)
 
+    @instrumented
     def to_grayscale(self):
-        if self.display_image is not None:
-            self.push_undo()
-            self.display_image = cv2.cvtColor(
-                self.display_image, cv2.COLOR_BGR2GRAY)
-            self.display_image = cv2.cvtColor(
-                self.display_image, cv2.COLOR_GRAY2BGR)
-            self.update_canvas_with_image(
-                self.display_image, self.cropped_canvas)
+        if self.graph is not None:
+            self.apply_edit(("grayscale",))
 
+    @instrumented
     def apply_blur(self):
-        if self.display_image is not None:
-            self.push_undo()
-            self.display_image = cv2.GaussianBlur(
-                self.display_image, (15, 15), 0)
-            self.update_canvas_with_image(
-                self.display_image, self.cropped_canvas)
-
-    def push_undo(self):
-        if self.display_image is not None:
-            self.undo_stack.append(copy.deepcopy(self.display_image))
-            self.redo_stack.clear()
+        if self.graph is not None:
+            self.apply_edit(("blur", int(self.blur_slider.get())))
+
+    def preview_blur(self, value):
+        # Every tick renders on the pool; results that arrive after a newer tick are dropped
+        if self.graph is None:
+            return
+        self.blur_generation += 1
+        if self.blur_future is not None:
+            self.blur_future.cancel()
+        document = self.document
+        ksize = scale_op(("blur", int(value)), document.graph.scale)[1]
+        self.blur_future = self.pool.submit(
+            self.render_blur_preview, document, document.graph.head, ksize,
+            self.blur_generation)
+        self.when_done(self.blur_future, self.show_blur_preview, RESIZE_POLL_MS)
+
+    @instrumented
+    def render_blur_preview(self, document, node, ksize, generation):
+        # Runs on the pool, so it must not touch Tk
+        if generation != self.blur_generation:
+            return None  # Superseded before it started
+        view = blur_preview(self.pyramid_for(document, node), ksize, CANVAS_WIDTH, CANVAS_HEIGHT)
+        return generation, to_pil(view)
 
+    def show_blur_preview(self, future):
+        result = future.result()
+        if result is not None and result[0] == self.blur_generation:
+            self.show_on_canvas(result[1], self.cropped_canvas)
+
+    @instrumented
     def rotate_image(self):
-        if self.display_image is not None:
-            self.push_undo()
-            self.display_image = cv2.rotate(
-                self.display_image, cv2.ROTATE_90_CLOCKWISE)
-            self.update_canvas_with_image(
-                self.display_image, self.cropped_canvas)
+        if self.graph is not None:
+            self.apply_edit(("rotate", 90))
+
+    def apply_edit(self, op):
+        # Only record the edit; pixels are computed when the canvas refreshes
+        self.push_undo(op)
+        self.schedule_refresh(op[0])
+
+    @instrumented
+    def push_undo(self, op):
+        if self.graph is not None:
+            self.graph.push(op)
 
+    @instrumented
     def undo(self):
-        if self.undo_stack:
-            self.redo_stack.append(copy.deepcopy(self.display_image))
-            self.display_image = self.undo_stack.pop()
-            self.update_canvas_with_image(
-                self.display_image, self.cropped_canvas)
+        if self.graph is not None and self.graph.undo():
+            self.schedule_refresh("undo")
 
+    @instrumented
     def redo(self):
-        if self.redo_stack:
-            self.undo_stack.append(copy.deepcopy(self.display_image))
-            self.display_image = self.redo_stack.pop()
-            self.update_canvas_with_image(
-                self.display_image, self.cropped_canvas)
+        if self.graph is not None and self.graph.redo():
+            self.schedule_refresh("redo")
+
+    def schedule_refresh(self, action):
+        # Several clicks before the next idle moment are evaluated together
+        self.pending_action = action
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.root.after_idle(self.refresh)
+
+    @instrumented
+    def refresh(self):
+        # Evaluates the current edit on the pool and shows it when ready
+        self.refresh_pending = False
+        document = self.document
+        if document is None:
+            return
+        self.cancel_previews()
+        if document.render_future is not None:
+            document.render_future.cancel()
+        document.render_future = self.pool.submit(
+            self.render_preview, document, document.graph.head)
+        self.when_done(document.render_future, functools.partial(
+            self.show_preview, document, self.pending_action, time.perf_counter()))
+
+    def pyramid_for(self, document, node):
+        image = document.graph.evaluate(node)
+        pyramid = document.pyramid
+        if pyramid is None or pyramid.source is not image:
+            pyramid = document.pyramid = PreviewPyramid(image)
+        return pyramid
+
+    @instrumented
+    def render_preview(self, document, node):
+        # Runs on the pool: evaluate the edit and convert the visible window
+        view = self.pyramid_for(document, node).viewport(1.0, CANVAS_WIDTH, CANVAS_HEIGHT)
+        return node, None if view is None else to_pil(view)
+
+    def show_preview(self, document, action, started, future):
+        document.preview = future.result()
+        if document is not self.document or document.preview[0] is not document.graph.head:
+            return  # Switched away or edited again meanwhile; that refresh will show it
+        self.show_on_canvas(document.preview[1], self.cropped_canvas)
+        self.latency[action] = (time.perf_counter() - started) * 1000
+        self.update_status()
+
+    def update_status(self):
+        parts = []
+        if self.document is not None:
+            parts.append(self.document.name)
+            shape = self.graph.head_shape()
+            if shape is not None:
+                mode = "gray" if len(shape) == 2 else "bgr"
+                parts.append(f"{shape[1]}x{shape[0]} {mode}")
+            parts.append(self.graph.report())
+            journal = self.graph.journal
+            if journal is not None and journal.error is not None:
+                parts.append(f"session not saved: {journal.error.strerror or journal.error}")
+        for action in ("undo", "redo"):
+            if action in self.latency:
+                parts.append(f"{action} {self.latency[action]:.0f} ms")
+        rss = peak_rss_mb()
+        if rss is not None:
+            parts.append(f"peak RSS {rss:.0f} MB")
+        self.status.config(text=" | ".join(parts))
+
+
+# Headless batch mode: apply an operation chain to many files without the GUI
+def parse_op(spec):
+    # "blur:15" -> ("blur", 15), "crop:0:0:640:480" -> ("crop", 0, 0, 640, 480)
+    name, *args = spec.split(":")
+    if name not in OPERATIONS:
+        raise argparse.ArgumentTypeError(
+            f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+    try:
+        op = (name, *(int(a) for a in args))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"operation arguments must be integers: {spec!r}")
+    # Catch what OpenCV would reject, before every file in the batch fails on it
+    if name == "blur" and len(op) > 1 and (op[1] <= 0 or op[1] % 2 == 0):
+        raise argparse.ArgumentTypeError(f"blur size must be odd and positive: {spec!r}")
+    if name == "rotate" and len(op) > 1 and op[1] % 90:
+        raise argparse.ArgumentTypeError(f"rotate angle must be a multiple of 90: {spec!r}")
+    if name == "crop" and len(op) != 5:
+        raise argparse.ArgumentTypeError(f"crop needs x0:y0:x1:y1: {spec!r}")
+    if name == "resize" and len(op) > 1 and op[1] <= 0:
+        raise argparse.ArgumentTypeError(f"resize percentage must be positive: {spec!r}")
+    return op
+
+
+def find_images(inputs):
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        paths.extend(p for p in sorted(glob.glob(pattern)) if os.path.isfile(p))
+    return list(dict.fromkeys(paths))  # Drop duplicates from overlapping patterns
+
+
+def init_batch_worker():
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+
+
+def process_file(job):
+    path, ops, output_dir = job
+    try:
+        img = read_image(path)
+        if img is None:
+            raise ValueError("could not decode image")
+        for op in fuse_ops(ops):
+            img = apply_op(img, op)
+        out_path = os.path.join(output_dir, os.path.basename(path))
+        if not cv2.imwrite(out_path, img):
+            raise ValueError(f"could not write {out_path}")
+        return path, os.path.getsize(path), None
+    except Exception as e:
+        return path, 0, f"{type(e).__name__}: {e}"
+
+
+def batch_process(paths, ops, output_dir, workers=None):
+    os.makedirs(output_dir, exist_ok=True)
+    # Outputs keep the input's file name, so inputs from different folders can clash;
+    # the first one is written and the others are reported instead of overwriting it
+    jobs = []
+    failures = []
+    outputs = {}
+    for path in paths:
+        name = os.path.normcase(os.path.basename(path))
+        if name in outputs:
+            failures.append((path, f"output name clashes with {outputs[name]}"))
+            continue
+        outputs[name] = path
+        jobs.append((path, ops, output_dir))
+    total_bytes = 0
+    t0 = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_batch_worker) as pool:
+        for path, size, error in pool.imap_unordered(process_file, jobs, chunksize=4):
+            if error:
+                failures.append((path, error))
+            total_bytes += size
+    elapsed = time.perf_counter() - t0
+    return {
+        "images": len(paths) - len(failures),
+        "failures": failures,
+        "seconds": elapsed,
+        "images_per_s": (len(paths) - len(failures)) / elapsed if elapsed else 0.0,
+        "mb_per_s": total_bytes / (1024 * 1024) / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Image Editor App")
+    parser.add_argument("--batch", nargs="+", metavar="INPUT",
+                        help="process these directories/globs headless instead of opening the GUI")
+    parser.add_argument("--ops", nargs="+", type=parse_op, default=[], metavar="OP",
+                        help="operation chain, e.g. grayscale blur:15 rotate:90 crop:0:0:640:480 resize:50")
+    parser.add_argument("--output", default="output", help="directory for processed images")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--profile", action="store_true",
+                        help="show per-action latency and memory in the GUI (Ctrl+E exports a trace)")
+    parser.add_argument("--trace", metavar="JSON",
+                        help="profile the GUI session and write a Chrome trace here on exit")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="don't keep or restore edit sessions on disk")
+    args = parser.parse_args(argv)
+
+    if not args.batch:
+        instrumentation = Instrumentation() if args.profile or args.trace else None
+        root = tk.Tk()
+        ImageEditorApp(root, instrumentation=instrumentation,
+                       journal_dir=None if args.no_journal else JOURNAL_DIR)
+        root.mainloop()
+        if args.trace:
+            instrumentation.export_chrome_trace(args.trace)
+        return 0
+
+    paths = find_images(args.batch)
+    if not paths:
+        print("No input files found.")
+        return 1
+    summary = batch_process(paths, args.ops, args.output, args.workers)
+    print(f"Processed {summary['images']} of {len(paths)} images in {summary['seconds']:.2f} s "
+          f"({summary['images_per_s']:.1f} images/s, {summary['mb_per_s']:.1f} MB/s)")
+    for path, error in summary["failures"]:
+        print(f"FAILED {path}: {error}")
+    return 1 if summary["failures"] else 0
 
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = ImageEditorApp(root)
-    root.mainloop()
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# Headless stress benchmark for the space battle engine.
+# Runs parameterised loads (many enemies firing fast, thousands of bullets, many
+# collectibles) through the game's own Game.step update and collision code, using
+# SDL's dummy video and audio drivers, and reports ticks/s, frame-time percentiles
+# and memory.
+#
+#   python q2_benchmark.py --enemies 10 100 500 --attack-rates 90 10 --output bench.json
+#   python q2_benchmark.py --output new.json --compare bench.json
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pygame
+
+import perf_utils
+import q2_space_battle as game_module
+
+# The player holds fire and strafes, so the shot and collision paths stay busy
+BENCH_KEYS = game_module.HeldKeys([pygame.K_SPACE, pygame.K_RIGHT])
+
+
+def setup(enemies, attack_rate, collectibles, bullet_capacity, seed):
+    # A game on the last level (no level-complete interruptions) with a custom wave
+    game_module.rng.seed(seed)
+    game_module.bullets = game_module.BulletPool(bullet_capacity)
+    game = game_module.Game()
+    game.current_level = 3
+    rng = game_module.rng
+    wave = []
+    for _ in range(enemies):
+        enemy = game_module.Enemy(rng.randint(50, game_module.WIDTH - 50), rng.randint(-300, game_module.HEIGHT))
+        enemy.attack_rate = attack_rate
+        enemy.attack_timer = rng.randrange(attack_rate)  # Don't all fire on the same tick
+        wave.append(enemy)
+    game.enemies.empty()
+    game.enemies.add(wave)
+    game.level_target_kills = sys.maxsize
+    for _ in range(collectibles):
+        item = game_module.Collectible(0, 0, "score_boost")
+        game.collectible_pool.append(item)
+    top_up(game, collectibles)
+    return game
+
+
+def top_up(game, collectibles):
+    # Put picked-up or fallen collectibles back so the load stays constant
+    rng = game_module.rng
+    for item in game.collectible_pool[:collectibles]:
+        if not item.alive():
+            item.reset(rng.randint(50, game_module.WIDTH - 50), rng.randint(0, game_module.HEIGHT),
+                       rng.choice(["health_boost", "extra_life", "score_boost"]))
+            game.collectibles.add(item)
+
+
+def run_ticks(game, ticks, collectibles, render):
+    # Returns the time of every tick and the number of live bullets after it
+    times = []
+    live_bullets = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        game.step(BENCH_KEYS)
+        if render:
+            game.draw(game_module.win, 1.0)
+        times.append(time.perf_counter() - start)
+        live_bullets.append(int(np.count_nonzero(game_module.bullets.active)))
+        # Keep the wave going: the player can't die and escapes never end the game
+        game.player.lives = 1_000_000
+        game.enemy_escape_count = -1_000_000
+        top_up(game, collectibles)
+    return times, live_bullets
+
+
+def case_key(r):
+    return r["enemies"], r["attack_rate"], r["collectibles"], r["render"]
+
+
+def describe(r):
+    return f"{r['enemies']:>5} enemies, fire every {r['attack_rate']:>3} ticks, {r['collectibles']:>4} collectibles"
+
+
+def run_case(enemies, attack_rate, collectibles, args):
+    game = setup(enemies, attack_rate, collectibles, args.bullet_capacity, args.seed)
+    run_ticks(game, args.warmup, collectibles, args.render)  # Fill the screen with bullets first
+    times, live_bullets = run_ticks(game, args.ticks, collectibles, args.render)
+    # A second, traced pass for memory; tracemalloc slows it down, so it isn't timed
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    run_ticks(game, args.ticks, collectibles, args.render)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    frame_ms = np.array(times) * 1000
+    p50, p99 = np.percentile(frame_ms, [50, 99])
+    stats = {
+        "enemies": enemies, "attack_rate": attack_rate, "collectibles": collectibles,
+        "render": args.render, "ticks": args.ticks,
+        "ticks_per_s": len(times) / sum(times),
+        "frame_ms_p50": p50, "frame_ms_p99": p99, "frame_ms_max": frame_ms.max(),
+        "live_bullets_mean": sum(live_bullets) / len(live_bullets),
+        "heap_peak_mb": (peak - before) / (1024 * 1024),
+        "heap_growth_kb": (current - before) / 1024,
+    }
+    print(f"{describe(stats)}: {stats['ticks_per_s']:8.0f} ticks/s  p50 {p50:6.3f} ms  p99 {p99:6.3f} ms  "
+          f"{stats['live_bullets_mean']:6.0f} bullets")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stress-test the space battle engine headless")
+    parser.add_argument("--enemies", nargs="+", type=int, default=[10, 100, 500],
+                        help="enemy counts to run")
+    parser.add_argument("--attack-rates", nargs="+", type=int, default=[90, 10],
+                        help="ticks between enemy shots (the game uses 90)")
+    parser.add_argument("--collectibles", nargs="+", type=int, default=[200],
+                        help="collectibles kept on screen")
+    parser.add_argument("--ticks", type=int, default=600, help="timed ticks per case")
+    parser.add_argument("--warmup", type=int, default=120, help="untimed ticks before timing")
+    parser.add_argument("--bullet-capacity", type=int, default=16384, help="size of the bullet pool")
+    parser.add_argument("--render", action="store_true",
+                        help="also draw every tick (to the dummy display)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="q2_benchmark.json", help="JSON results file")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    game_module.init_game(headless=True)
+    results = []
+    for enemies in args.enemies:
+        for attack_rate in args.attack_rates:
+            for collectibles in args.collectibles:
+                results.append(run_case(enemies, attack_rate, collectibles, args))
+
+    perf_utils.write_report(args.output, results, pygame=pygame.version.ver)
+    if args.compare:
+        perf_utils.compare(results, args.compare, case_key, "ticks_per_s",
+                           "ticks per second", describe)
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,27 @@
 # Importing libraries
 import pygame
 import random
+import argparse
+import collections
+import functools
+import itertools
+import csv
 import cv2 # OpenCV is used to play a video background
+import json
 import numpy as np
 import os
+import queue
 import sys
+import threading
+import time
+import tracemalloc
+import zlib
 
-pygame.init() # Initialize pygame
+STARTED_AT = time.perf_counter() # For time-to-first-frame reporting
 
-# Set screen dimensions and create a window
+# Screen dimensions; the window itself is created by init_game()
 WIDTH, HEIGHT = 960, 540
-win = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Space Battle")
+win = None
 
 # Define some color constants
 WHITE = (255, 255, 255)
@@ -25,64 +35,441 @@ BLUE = (0, 0, 200) # For level complete text
 GROUND = HEIGHT - 60
 
 # Frame rate settings
-FPS = 60
-FONT = pygame.font.SysFont(None, 30)
-BIG_FONT = pygame.font.SysFont(None, 50)
+FPS = 60 # Render rate cap
+TICK_RATE = 60 # Simulation steps per second, independent of how fast we render
+TICK_SECONDS = 1 / TICK_RATE
+MAX_FRAME_SECONDS = 0.25 # Longest stall we catch up on, so a hitch can't snowball
+FONT = BIG_FONT = None # Created by init_game()
 clock = pygame.time.Clock()
 
+# All simulation randomness comes from here so a seed reproduces a run; purely
+# cosmetic effects (win screen sparkles) keep using the global random module
+rng = random.Random()
+
 # Folder where all input files are stored
 BASE_PATH = "Input" # Make sure you have this folder with your assets!
 
-# Load background music and set it to loop
-pygame.mixer.music.load(os.path.join(BASE_PATH, "space.mp3"))
-pygame.mixer.music.play(-1)
-pygame.mixer.music.set_volume(0.5)
-
-# Load and scale images
-player_img = pygame.transform.scale(
-    pygame.image.load(os.path.join(BASE_PATH, "player_plane.png")), (40, 90))
-enemy_img = pygame.transform.rotate(
-    pygame.transform.scale(
-        pygame.image.load(os.path.join(BASE_PATH, "enemy_plane.png")), (40, 80)), 180)
-boss_img = pygame.transform.scale(
-    pygame.image.load(os.path.join(BASE_PATH, "boss_plane.png")), (120, 180))
-
-# Load sound effects
-bullet_sound = pygame.mixer.Sound(os.path.join(BASE_PATH, "bulletshot.mp3"))
-victory_sound = pygame.mixer.Sound(os.path.join(BASE_PATH, "victory.mp3"))
-collect_sound = pygame.mixer.Sound(os.path.join(BASE_PATH, "collect.mp3")) # Make sure you have a collect.mp3
-level_up_sound = pygame.mixer.Sound(os.path.join(BASE_PATH, "levelup.mp3")) # New: Level up sound
-
-# Load background video using OpenCV
-cap = cv2.VideoCapture(os.path.join(BASE_PATH, "backvd.mp4"))
-
-# Projectile class for both player and enemy bullets
-class Projectile(pygame.sprite.Sprite):
-    def __init__(self, x, y, direction, is_enemy=False):
-        super().__init__()
-        self.image = pygame.Surface((5, 10))
-        self.image.fill(RED if is_enemy else WHITE)
-        self.rect = self.image.get_rect(center=(x, y))
-        self.direction = direction
-        self.speed = 10
-
-    # Move projectile and destroy it if out of screen bounds
+# Images as (file, size, rotation); each variant is scaled and rotated once and cached
+PLAYER_IMAGE = ("player_plane.png", (40, 90), 0)
+ENEMY_IMAGE = ("enemy_plane.png", (40, 80), 180)
+BOSS_IMAGE = ("boss_plane.png", (120, 180), 0)
+
+# Sound effects
+BULLET_SOUND = "bulletshot.mp3"
+VICTORY_SOUND = "victory.mp3"
+COLLECT_SOUND = "Collect.mp3"
+LEVEL_UP_SOUND = "levelup.mp3" # New: Level up sound
+
+# Loads images and sounds on first use, or ahead of time on a background thread,
+# and keeps them. Images are converted to the display format as they load so
+# blits don't pay a per-pixel conversion.
+class Assets:
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.cache = {}
+        self.lock = threading.Lock() # One load at a time; a second caller waits, then hits the cache
+        self.loader = None
+        self.load_seconds = 0.0
+
+    def image(self, name, size=None, angle=0):
+        key = (name, size, angle)
+        surface = self.cache.get(key)
+        if surface is not None:
+            return surface
+        if size is None and angle == 0:
+            with self.lock:
+                if key not in self.cache:
+                    start = time.perf_counter()
+                    self.cache[key] = pygame.image.load(os.path.join(self.base_path, name)).convert_alpha()
+                    self.load_seconds += time.perf_counter() - start
+                return self.cache[key]
+        surface = self.image(name) # Variants are made from the cached original
+        if size is not None:
+            surface = pygame.transform.scale(surface, size)
+        if angle:
+            surface = pygame.transform.rotate(surface, angle)
+        self.cache[key] = surface
+        return surface
+
+    def sound(self, name):
+        sound = self.cache.get(name)
+        if sound is not None:
+            return sound
+        with self.lock:
+            if name not in self.cache:
+                start = time.perf_counter()
+                self.cache[name] = pygame.mixer.Sound(os.path.join(self.base_path, name))
+                self.load_seconds += time.perf_counter() - start
+            return self.cache[name]
+
+    # Start loading in the background; later image()/sound() calls find them ready
+    def preload(self, images, sounds):
+        def load_all():
+            for image in images:
+                self.image(*image)
+            for name in sounds:
+                self.sound(name)
+        self.loader = threading.Thread(target=load_all, daemon=True)
+        self.loader.start()
+
+assets = Assets(BASE_PATH)
+
+# Per sound: (max voices playing at once, priority, coalescing window in seconds).
+# Identical sounds started within the window are merged into one, a sound already
+# at its voice cap is dropped, and when every channel is busy a sound may take
+# over the channel of the lowest-priority sound that is playing.
+SOUND_SETTINGS = {
+    BULLET_SOUND: (4, 0, 0.05),
+    COLLECT_SOUND: (2, 2, 0.0),
+    LEVEL_UP_SOUND: (1, 3, 0.0),
+    VICTORY_SOUND: (1, 3, 0.0),
+}
+MIXER_CHANNELS = 8
+
+class AudioManager:
+    def __init__(self, assets, channels=MIXER_CHANNELS):
+        self.assets = assets
+        self.enabled = False # Turned on by init_game() unless running headless or muted
+        self.num_channels = channels
+        self.channels = []
+        self.playing = {} # Channel index -> (sound name, priority, start time)
+        self.last_started = {} # Sound name -> start time
+
+    def start(self):
+        pygame.mixer.set_num_channels(self.num_channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(self.num_channels)]
+        self.enabled = True
+
+    def play(self, name):
+        if not self.enabled:
+            return
+        max_voices, priority, window = SOUND_SETTINGS[name]
+        now = time.perf_counter()
+        if now - self.last_started.get(name, -window) < window:
+            return # Coalesce with the copy that just started
+
+        free = None
+        voices = 0
+        for index, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                self.playing.pop(index, None)
+                if free is None:
+                    free = index
+            elif self.playing.get(index, (None,))[0] == name:
+                voices += 1
+        if voices >= max_voices:
+            return
+        if free is None:
+            free = self.steal_channel(priority)
+            if free is None:
+                return # Everything playing matters at least as much
+
+        self.channels[free].play(self.assets.sound(name))
+        self.playing[free] = (name, priority, now)
+        self.last_started[name] = now
+
+    # The channel of the lowest-priority, oldest sound below this priority, if any
+    def steal_channel(self, priority):
+        candidates = [(playing_priority, started, index)
+                      for index, (_, playing_priority, started) in self.playing.items()
+                      if playing_priority < priority]
+        if not candidates:
+            return None
+        _, _, index = min(candidates)
+        self.channels[index].stop()
+        return index
+
+audio = AudioManager(assets)
+
+# Start pygame and open the window. Headless runs have no window or sound, so SDL
+# gets its dummy drivers; they, and runs with sound off, skip the mixer entirely.
+def init_game(headless=False, sound=True):
+    global win, FONT, BIG_FONT
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+    pygame.init() # Initialize pygame
+    if headless or not sound:
+        pygame.mixer.quit() # No mixing thread at all when nothing will be heard
+    win = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Space Battle")
+    FONT = pygame.font.SysFont(None, 30)
+    BIG_FONT = pygame.font.SysFont(None, 50)
+
+    # Load background music and set it to loop
+    if not headless and sound and pygame.mixer.get_init(): # No audio device: carry on silently
+        audio.start()
+        pygame.mixer.music.load(os.path.join(BASE_PATH, "space.mp3"))
+        pygame.mixer.music.play(-1)
+        pygame.mixer.music.set_volume(0.5)
+
+# Print how long it took to get a frame on screen, once per kind of frame
+reported_frames = set()
+
+def report_first_frame(what, since=STARTED_AT):
+    if what not in reported_frames:
+        reported_frames.add(what)
+        print(f"First {what} frame after {(time.perf_counter() - since) * 1000:.0f} ms "
+              f"({assets.load_seconds * 1000:.0f} ms of asset loading so far)")
+
+# Number of decoded background frames kept ready ahead of the game loop
+VIDEO_BUFFER_FRAMES = 8
+
+# Turn a decoded BGR video frame into a surface that can be blitted directly
+def prepare_frame(frame, size):
+    frame = cv2.resize(frame, size)
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    frame = cv2.flip(frame, 1) # Keep the mirrored look of the old rot90/make_surface path
+    surface = pygame.image.frombuffer(frame, size, "RGB") # Shares the array, no extra copy
+    return surface.convert() # Match the display format so blits are plain copies
+
+# Decodes the background video on its own thread so the game loop only blits
+class VideoPrefetcher:
+    def __init__(self, path, size, buffer_frames=VIDEO_BUFFER_FRAMES):
+        self.cap = cv2.VideoCapture(path)
+        self.size = size
+        self.frames = queue.Queue(maxsize=buffer_frames) # Bounded ring of ready frames
+        self.last_frame = None
+        self.running = True
+        self.thread = threading.Thread(target=self.decode_loop, daemon=True)
+        self.thread.start()
+
+    def decode_loop(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret: # If video ends, loop it from the beginning
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self.cap.read()
+                if not ret: # Missing or unreadable video: keep the last frame on screen
+                    break
+            try:
+                surface = prepare_frame(frame, self.size)
+            except pygame.error: # Display was closed while we were decoding
+                break
+            # Wait for room in the buffer, checking now and then whether we were stopped
+            while self.running:
+                try:
+                    self.frames.put(surface, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+        self.cap.release()
+
+    # Next frame to show; reuses the previous one if the decoder fell behind
+    def next_frame(self):
+        try:
+            self.last_frame = self.frames.get_nowait()
+        except queue.Empty:
+            pass
+        return self.last_frame
+
+    def draw(self, surface):
+        frame = self.next_frame()
+        if frame is None: # Nothing decoded yet
+            surface.fill(BLACK)
+        else:
+            surface.blit(frame, (0, 0))
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+# Optional pre-baked background: every frame stored raw in the display's pixel layout
+VIDEO_PATH = os.path.join(BASE_PATH, "backvd.mp4")
+BAKE_PATH = os.path.join(BASE_PATH, "backvd.frames") # Header is written next to it as .json
+
+# Pixel layout for baked frames; on a 32-bit XRGB display they blit as plain copies
+def frame_layout():
+    if win.get_bitsize() == 32 and win.get_masks()[:3] == (0xFF0000, 0x00FF00, 0x0000FF):
+        return "BGRA"
+    return "RGB"
+
+# What a bake depends on; any change here makes an existing bake stale
+def bake_key(video_path, size):
+    stat = os.stat(video_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns,
+            "width": size[0], "height": size[1], "layout": frame_layout()}
+
+# Header of a bake that still matches the source video and resolution, else None
+def current_bake(video_path, bake_path, size):
+    try:
+        with open(bake_path + ".json") as f:
+            header = json.load(f)
+        key = bake_key(video_path, size)
+        store_size = os.path.getsize(bake_path)
+    except (OSError, ValueError):
+        return None
+    if any(header.get(name) != value for name, value in key.items()):
+        return None
+    channels = len(header["layout"])
+    if store_size != header["frames"] * size[0] * size[1] * channels:
+        return None # Truncated or overwritten frame store
+    return header
+
+# Decode the whole clip once and write it out as raw frames
+def bake_video(video_path, bake_path, size):
+    header = bake_key(video_path, size)
+    convert = cv2.COLOR_BGR2BGRA if header["layout"] == "BGRA" else cv2.COLOR_BGR2RGB
+    cap = cv2.VideoCapture(video_path)
+    frames = 0
+    with open(bake_path + ".tmp", "wb") as out:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, size)
+            frame = cv2.flip(frame, 1) # Same mirrored look as the live decoder
+            out.write(cv2.cvtColor(frame, convert).tobytes())
+            frames += 1
+    cap.release()
+    if frames == 0:
+        os.remove(bake_path + ".tmp")
+        raise ValueError(f"Could not decode any frames from {video_path}")
+    header["frames"] = frames
+    os.replace(bake_path + ".tmp", bake_path)
+    with open(bake_path + ".json", "w") as f:
+        json.dump(header, f)
+    print(f"Baked {frames} background frames to {bake_path}")
+    return header
+
+# Plays a baked frame store straight out of a memory map: no decoding, no copies
+class BakedVideo:
+    def __init__(self, bake_path, header):
+        size = (header["width"], header["height"])
+        self.data = np.memmap(bake_path, dtype=np.uint8, mode="r",
+                              shape=(header["frames"], size[1], size[0], len(header["layout"])))
+        self.surfaces = []
+        for frame in self.data:
+            surface = pygame.image.frombuffer(frame, size, header["layout"]) # Shares the mapped pages
+            surface.set_alpha(None) # The fourth byte is padding, not alpha
+            self.surfaces.append(surface)
+        self.index = -1
+
+    def next_frame(self):
+        self.index = (self.index + 1) % len(self.surfaces)
+        return self.surfaces[self.index]
+
+    def draw(self, surface):
+        surface.blit(self.next_frame(), (0, 0))
+
+    def stop(self):
+        pass
+
+# Use the baked frames when they are current, else decode the video live.
+# A stale bake (source or resolution changed) is rebuilt automatically.
+def open_background(bake=False):
+    size = (WIDTH, HEIGHT)
+    header = current_bake(VIDEO_PATH, BAKE_PATH, size)
+    if header is None and (bake or os.path.exists(BAKE_PATH)):
+        header = bake_video(VIDEO_PATH, BAKE_PATH, size)
+    if header is not None:
+        return BakedVideo(BAKE_PATH, header)
+    return VideoPrefetcher(VIDEO_PATH, size)
+
+background = None # Opened on first use by main()
+
+# Bullets live in one fixed-size pool stored as parallel NumPy arrays, so moving,
+# culling and overlap tests run over all of them at once instead of per sprite
+BULLET_CAPACITY = 1024
+BULLET_WIDTH, BULLET_HEIGHT = 5, 10
+BULLET_SPEED = 10
+PLAYER_BULLET, ENEMY_BULLET = 0, 1
+
+class BulletPool:
+    def __init__(self, capacity=BULLET_CAPACITY):
+        self.x = np.zeros(capacity, dtype=np.int32) # Left edge
+        self.y = np.zeros(capacity, dtype=np.int32) # Top edge
+        self.prev_y = np.zeros(capacity, dtype=np.int32) # Top edge before the last tick, for interpolation
+        self.dy = np.zeros(capacity, dtype=np.int32) # Pixels per frame, signed
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    # Fire a bullet centred on (x, y); returns False if the pool is full
+    def spawn(self, x, y, direction, kind):
+        slot = int(np.argmin(self.active)) # First free slot
+        if self.active[slot]:
+            return False
+        self.x[slot] = x - BULLET_WIDTH // 2
+        self.y[slot] = y - BULLET_HEIGHT // 2
+        self.prev_y[slot] = self.y[slot]
+        self.dy[slot] = BULLET_SPEED * direction
+        self.kind[slot] = kind
+        self.active[slot] = True
+        return True
+
+    # Move every bullet and free the ones that left the screen
     def update(self):
-        self.rect.y += self.speed * self.direction
-        if self.rect.bottom < 0 or self.rect.top > HEIGHT:
-            self.kill()
+        np.copyto(self.prev_y, self.y)
+        self.y += self.dy
+        self.active &= (self.y + BULLET_HEIGHT >= 0) & (self.y <= HEIGHT)
+
+    def count(self, kind):
+        return int(np.count_nonzero(self.active & (self.kind == kind)))
+
+    def kill(self, slot):
+        self.active[slot] = False
+
+    def clear(self, kind=None):
+        if kind is None:
+            self.active[:] = False
+        else:
+            self.active &= self.kind != kind
+
+    # Slots of live bullets of this kind, in pool order
+    def live(self, kind):
+        return np.flatnonzero(self.active & (self.kind == kind))
+
+    def rect(self, slot):
+        return pygame.Rect(int(self.x[slot]), int(self.y[slot]), BULLET_WIDTH, BULLET_HEIGHT)
+
+    # Slots of live bullets of this kind overlapping rect (same test as Rect.colliderect)
+    def overlapping(self, rect, kind):
+        if rect.width <= 0 or rect.height <= 0:
+            return np.empty(0, dtype=np.intp) # Empty rects never collide
+        hit = (self.active & (self.kind == kind)
+               & (self.x < rect.right) & (self.x + BULLET_WIDTH > rect.left)
+               & (self.y < rect.bottom) & (self.y + BULLET_HEIGHT > rect.top))
+        return np.flatnonzero(hit)
+
+    # Draw alpha of the way from the previous tick's positions to the current ones
+    def draw(self, surface, kind, alpha=1.0):
+        image = bullet_image(kind)
+        slots = self.live(kind)
+        prev_y = self.prev_y[slots]
+        ys = prev_y + (self.y[slots] - prev_y) * alpha
+        surface.blits([(image, (x, y)) for x, y in zip(self.x[slots].tolist(), ys.tolist())],
+                      doreturn=False)
+
+# One pre-rendered surface per bullet type, shared by every bullet of that type
+@functools.lru_cache(maxsize=None)
+def bullet_image(kind):
+    image = pygame.Surface((BULLET_WIDTH, BULLET_HEIGHT))
+    image.fill(WHITE if kind == PLAYER_BULLET else RED)
+    return image
+
+bullets = BulletPool()
+
+# Where to draw a sprite alpha of the way between its last two simulated positions
+def interpolated(sprite, alpha):
+    prev_x, prev_y = sprite.prev_pos
+    return (prev_x + (sprite.rect.x - prev_x) * alpha,
+            prev_y + (sprite.rect.y - prev_y) * alpha)
 
 # Player class
 class Player(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = player_img
+        self.image = assets.image(*PLAYER_IMAGE)
+        self.reset()
+
+    # Back to the starting state, so one Player serves every game
+    def reset(self):
         self.rect = self.image.get_rect(midbottom=(WIDTH // 2, GROUND))
+        self.prev_pos = self.rect.topleft
         self.lives = 3 # Represents extra lives
         self.max_hits = 3 # Maximum hits before current life is lost
         self.hits_taken = 0 # Hits taken in current life
         self.score = 0
-        self.projectiles = pygame.sprite.Group()
         self.shoot_cooldown = 0
 
         # --- New: Jump variables ---
@@ -93,6 +480,7 @@ class Player(pygame.sprite.Sprite):
 
     # Player movements
     def update(self, keys):
+        self.prev_pos = self.rect.topleft
         # Horizontal movement
         if keys[pygame.K_LEFT] and self.rect.left > 0:
             self.rect.x -= 5
@@ -117,14 +505,12 @@ class Player(pygame.sprite.Sprite):
 
         # Shooting logic
         if keys[pygame.K_SPACE] and self.shoot_cooldown == 0:
-            if len(self.projectiles) < 5: # Limit active projectiles
-                shell = Projectile(self.rect.centerx, self.rect.top, -1)
-                self.projectiles.add(shell)
-                bullet_sound.play()
+            if bullets.count(PLAYER_BULLET) < 5: # Limit active projectiles
+                bullets.spawn(self.rect.centerx, self.rect.top, -1, PLAYER_BULLET)
+                audio.play(BULLET_SOUND)
                 self.shoot_cooldown = 15 # Cooldown in frames
         if self.shoot_cooldown > 0:
             self.shoot_cooldown -= 1
-        self.projectiles.update()
 
     def take_hit(self):
         self.hits_taken += 1
@@ -143,99 +529,171 @@ class Player(pygame.sprite.Sprite):
 class Enemy(pygame.sprite.Sprite):
     def __init__(self, x, y, health=50, boss=False, speed=1.5):
         super().__init__()
+        self.reset(x, y, health, boss, speed)
+
+    # Set up as a fresh enemy; load_level uses this to recycle enemies between levels and games
+    def reset(self, x, y, health=50, boss=False, speed=1.5):
         self.boss = boss
-        self.image = boss_img if boss else enemy_img
+        self.image = assets.image(*(BOSS_IMAGE if boss else ENEMY_IMAGE))
         self.rect = self.image.get_rect(topleft=(x, y))
+        self.prev_pos = self.rect.topleft
         self.max_health = 250 if boss else health
         self.health = self.max_health
         self.speed = speed
         self.attack_timer = 0
         self.attack_rate = 90 # How often the enemy shoots
-        self.projectiles = pygame.sprite.Group()
 
     # Move enemy downward and shoot if cooldown is done
     def update(self):
+        self.prev_pos = self.rect.topleft
         self.rect.y += self.speed
         self.attack_timer += 1
         if self.attack_timer >= self.attack_rate:
             self.attack_timer = 0
             self.shoot()
-        self.projectiles.update()
 
     def shoot(self):
-        # Create a projectile shot by the enemy
-        shell = Projectile(self.rect.centerx, self.rect.bottom, 1, is_enemy=True)
-        self.projectiles.add(shell)
-        bullet_sound.play()
+        # Fire a bullet from the shared pool
+        bullets.spawn(self.rect.centerx, self.rect.bottom, 1, ENEMY_BULLET)
+        audio.play(BULLET_SOUND)
 
-    def draw_health_bar(self, surface):
+    def draw_health_bar(self, surface, pos):
         # Draw health bar above enemy
+        x, y = pos
         health_percentage = self.health / self.max_health
         bar_width = 75 if self.boss else 40
-        pygame.draw.rect(surface, RED, (self.rect.x, self.rect.y - 10, bar_width, 5))
-        pygame.draw.rect(surface, GREEN, (self.rect.x, self.rect.y - 10, bar_width * health_percentage, 5))
+        surface.blit(health_bar_image(bar_width, 5, health_percentage), (x, y - 10))
 
     def respawn(self):
         # Reset enemy position and health
         self.health = self.max_health
-        self.rect.y = -random.randint(60, 300)
-        self.rect.x = random.randint(50, WIDTH - 50)
+        self.rect.y = -rng.randint(60, 300)
+        self.rect.x = rng.randint(50, WIDTH - 50)
+        self.prev_pos = self.rect.topleft # Jump straight there, don't interpolate across the screen
 
 # --- New: Collectible Class ---
+# Different visual for each collectible type, shared by every collectible of that type
+@functools.lru_cache(maxsize=None)
+def collectible_image(type):
+    image = pygame.Surface((20, 20))
+    if type == 'health_boost':
+        image.fill(GREEN) # Green square for health
+    elif type == 'extra_life':
+        image.fill(WHITE) # White square for extra life
+    elif type == 'score_boost':
+        image.fill((0, 255, 255)) # Cyan square for score
+    else: # Default for safety
+        image.fill(YELLOW)
+    return image
+
 class Collectible(pygame.sprite.Sprite):
     def __init__(self, x, y, type):
         super().__init__()
-        self.type = type # 'health_boost', 'extra_life', 'score_boost'
+        self.reset(x, y, type)
 
-        # Different visual for each collectible type
-        self.image = pygame.Surface((20, 20))
+    # Set up as a freshly dropped collectible, so spent ones can be reused
+    def reset(self, x, y, type):
+        self.type = type # 'health_boost', 'extra_life', 'score_boost'
+        self.image = collectible_image(type)
         if self.type == 'health_boost':
-            self.image.fill(GREEN) # Green square for health
             self.value = 1 # Amount of health to restore (reduce hits taken)
         elif self.type == 'extra_life':
-            self.image.fill(WHITE) # White square for extra life
             self.value = 1 # Amount of extra life
         elif self.type == 'score_boost':
-            self.image.fill((0, 255, 255)) # Cyan square for score
             self.value = 100 # Score points
-        else: # Default for safety
-            self.image.fill(YELLOW)
 
         self.rect = self.image.get_rect(center=(x, y))
+        self.prev_pos = self.rect.topleft
         self.speed = 2 # Collectibles fall slowly
 
     def update(self):
+        self.prev_pos = self.rect.topleft
         self.rect.y += self.speed
         if self.rect.top > HEIGHT: # Remove if off-screen
             self.kill()
 
-# Draw any text to the screen
-def draw_text(surface, text, x, y, color=WHITE, font=FONT):
-    img = font.render(text, True, color)
-    surface.blit(img, (x, y))
+# Uniform grid used as a collision broadphase; rebuilt once per frame
+GRID_CELL_SIZE = 64 # Pixels; larger than a bullet, about the size of a regular enemy
+
+class SpatialHash:
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {} # (cell x, cell y) -> sprites touching that cell
+
+    def cell_range(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def insert(self, sprite):
+        for cell in self.cell_range(sprite.rect):
+            self.cells.setdefault(cell, []).append(sprite)
+
+    # Live sprites overlapping rect, in insertion order and without duplicates
+    def query(self, rect):
+        found = {}
+        for cell in self.cell_range(rect):
+            for sprite in self.cells.get(cell, ()):
+                if sprite not in found and sprite.alive() and rect.colliderect(sprite.rect):
+                    found[sprite] = True
+        return list(found)
+
+# Rendered text is cached by string, colour and font; most of it never changes
+@functools.lru_cache(maxsize=256)
+def render_text(text, color, font):
+    return font.render(text, True, color)
+
+# Draw any text to the screen; returns the area it covered
+def draw_text(surface, text, x, y, color=WHITE, font=None):
+    return surface.blit(render_text(text, color, font or FONT), (x, y))
+
+# A filled-in health bar, cached since health only changes in steps
+@functools.lru_cache(maxsize=64)
+def health_bar_image(bar_width, bar_height, health_percentage):
+    image = pygame.Surface((bar_width, bar_height))
+    image.fill(RED) # Background of bar
+    image.fill(GREEN, (0, 0, bar_width * health_percentage, bar_height)) # Actual health
+    return image
+
+# HUD(head up display) with lives, score, hits taken, enemies escaped, and player health bar.
+# Its text and bar are laid out once and only rebuilt when one of the values changes.
+class Hud:
+    def __init__(self):
+        self.values = None
+        self.blits = []
+
+    def draw(self, surface, player, enemy_escape_count, current_level):
+        values = (player.lives, player.score, player.hits_taken, player.max_hits, enemy_escape_count, current_level)
+        if values != self.values:
+            self.values = values
+            self.blits = self.layout(*values)
+        surface.blits(self.blits, doreturn=False)
+
+    def layout(self, lives, score, hits_taken, max_hits, enemy_escape_count, current_level):
+        # Player Health Bar (new)
+        bar_width = 100
+        bar_height = 10
+        # Calculate health based on hits taken (0 hits = full health, max_hits = empty)
+        health_percentage = max(0, (max_hits - hits_taken) / max_hits) # Prevent negative health bar
+
+        bar_x = 10
+        bar_y = 90 # Adjust position as needed to avoid overlapping other text
+
+        return [
+            (health_bar_image(bar_width, bar_height, health_percentage), (bar_x, bar_y)),
+            (render_text("Health:", WHITE, FONT), (bar_x + bar_width + 10, bar_y - 5)), # Label for health bar
+            (render_text(f"Lives: {lives}", WHITE, FONT), (10, 10)),
+            (render_text(f"Score: {score}", WHITE, FONT), (10, 30)),
+            (render_text(f"Hits Taken: {hits_taken} / {max_hits}", WHITE, FONT), (10, 50)),
+            (render_text(f"Enemies Escaped: {enemy_escape_count} / 6", WHITE, FONT), (10, 70)),
+            (render_text(f"Level: {current_level}", WHITE, FONT), (WIDTH - 100, 10)), # Display current level
+        ]
+
+hud = Hud()
 
-# Show HUD(head up display) with lives, score, hits taken, enemies escaped, and player health bar
 def draw_hud(player, enemy_escape_count, current_level): # Added current_level
-    # Player Health Bar (new)
-    bar_width = 100
-    bar_height = 10
-    # Calculate health based on hits taken (0 hits = full health, max_hits = empty)
-    health_percentage = (player.max_hits - player.hits_taken) / player.max_hits
-    if health_percentage < 0:
-        health_percentage = 0 # Prevent negative health bar
-
-    bar_x = 10
-    bar_y = 90 # Adjust position as needed to avoid overlapping other text
-
-    pygame.draw.rect(win, RED, (bar_x, bar_y, bar_width, bar_height)) # Background of bar
-    pygame.draw.rect(win, GREEN, (bar_x, bar_y, bar_width * health_percentage, bar_height)) # Actual health
-    draw_text(win, "Health:", bar_x + bar_width + 10, bar_y - 5) # Label for health bar
-
-    draw_text(win, f"Lives: {player.lives}", 10, 10)
-    draw_text(win, f"Score: {player.score}", 10, 30)
-    draw_text(win, f"Hits Taken: {player.hits_taken} / {player.max_hits}", 10, 50)
-    draw_text(win, f"Enemies Escaped: {enemy_escape_count} / 6", 10, 70)
-    draw_text(win, f"Level: {current_level}", WIDTH - 100, 10) # Display current level
+    hud.draw(win, player, enemy_escape_count, current_level)
 
 # Utility to wait for specific key presses
 def wait_for_key(allowed_keys=None):
@@ -245,13 +703,13 @@ def wait_for_key(allowed_keys=None):
     Returns the key pressed or None if quit requested.
     """
     while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if allowed_keys is None or event.key in allowed_keys:
-                    return event.key
+        event = pygame.event.wait() # Sleep until something happens instead of spinning
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
+        if event.type == pygame.KEYDOWN:
+            if allowed_keys is None or event.key in allowed_keys:
+                return event.key
 
 # Display Game Over screen and wait for player to restart or quit
 def game_over_screen():
@@ -276,35 +734,21 @@ def start_screen():
     draw_text(win, "Press any key to Start (WASD for movement, Space for Shoot)", WIDTH // 2 - 250, HEIGHT // 2 - 20)
     draw_text(win, "Press Q to Quit", WIDTH // 2 - 80, HEIGHT // 2 + 20)
     pygame.display.update()
+    report_first_frame("start screen")
 
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_q:
-                    pygame.quit()
-                    sys.exit()
-                else:
-                    return
+    if wait_for_key() == pygame.K_q:
+        pygame.quit()
+        sys.exit()
 
 # Show win screen after defeating boss
 def win_screen():
-    victory_sound.play()
+    audio.play(VICTORY_SOUND)
     win_timer = pygame.time.get_ticks()
     flash = True
     sparkles = [pygame.Rect(random.randint(0, WIDTH), random.randint(0, HEIGHT), 2, 2) for _ in range(100)]
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            ret, frame = cap.read()
-        frame = cv2.resize(frame, (WIDTH, HEIGHT))
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        background_surface = pygame.surfarray.make_surface(np.rot90(frame))
-        win.blit(background_surface, (0, 0))
+        background.draw(win)
 
         for sparkle in sparkles:
             pygame.draw.rect(win, (255, 255, 255), sparkle)
@@ -334,172 +778,579 @@ def win_screen():
 
 # New: Function to display "Level Complete" screen
 def level_complete_screen(current_level):
-    level_up_sound.play() # Play level up sound
+    audio.play(LEVEL_UP_SOUND) # Play level up sound
     start_time = pygame.time.get_ticks()
     duration = 2000 # Display for 2 seconds
 
-    while pygame.time.get_ticks() - start_time < duration:
-        win.fill(BLACK) # Clear screen
-        draw_text(win, f"LEVEL {current_level} COMPLETED!", WIDTH // 2 - 180, HEIGHT // 2 - 40, BLUE, BIG_FONT)
-        pygame.display.update()
+    win.fill(BLACK) # Clear screen
+    draw_text(win, f"LEVEL {current_level} COMPLETED!", WIDTH // 2 - 180, HEIGHT // 2 - 40, BLUE, BIG_FONT)
+    pygame.display.update() # Nothing on this screen changes, so it is drawn once
 
-        # Allow quitting during level complete screen
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
-                pygame.quit()
-                sys.exit()
+    # Sleep until an event arrives or the time is up; allow quitting meanwhile
+    remaining = duration
+    while remaining > 0:
+        event = pygame.event.wait(remaining)
+        remaining = duration - (pygame.time.get_ticks() - start_time)
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
+            pygame.quit()
+            sys.exit()
     return # Return to main game loop
 
 # Load enemies for each level
 # Modified: Now returns the number of enemies to defeat for this level
+# Reuse a spare enemy if there is one, else make a new one
+def spawn_enemy(spare, x, y, health=50, boss=False, speed=1.5):
+    if not spare:
+        return Enemy(x, y, health, boss, speed)
+    enemy = spare.pop()
+    enemy.reset(x, y, health, boss, speed)
+    return enemy
+
 def load_level(level, enemies):
+    spare = enemies.sprites() # Existing enemies are recycled rather than thrown away
     enemies.empty() # Clear existing enemies
+    bullets.clear(ENEMY_BULLET) # Their bullets go with them
     if level == 1:
         # Spawn 3 regular enemies with speed 1
         for _ in range(3):
-            enemies.add(Enemy(random.randint(50, WIDTH - 50), random.randint(-300, -60), speed=1))
+            enemies.add(spawn_enemy(spare, rng.randint(50, WIDTH - 50), rng.randint(-300, -60), speed=1))
         return 5 # New: Target 5 enemies to defeat for Level 1
     elif level == 2:
         # Spawn 5 regular enemies with slightly increased speed
         for _ in range(5):
-            enemies.add(Enemy(random.randint(50, WIDTH - 50), random.randint(-300, -60), speed=1.2))
+            enemies.add(spawn_enemy(spare, rng.randint(50, WIDTH - 50), rng.randint(-300, -60), speed=1.2))
         return 7 # New: Target 7 enemies to defeat for Level 2
     elif level == 3:
         # Spawn 3 regular enemies and 1 boss enemy
         for _ in range(3):
-            enemies.add(Enemy(random.randint(50, WIDTH - 50), random.randint(-300, -60), speed=1.5))
-        enemies.add(Enemy(random.randint(50, WIDTH - 50), random.randint(-300, -60), boss=True, speed=1.2))
+            enemies.add(spawn_enemy(spare, rng.randint(50, WIDTH - 50), rng.randint(-300, -60), speed=1.5))
+        enemies.add(spawn_enemy(spare, rng.randint(50, WIDTH - 50), rng.randint(-300, -60), boss=True, speed=1.2))
         return 1 # New: Target 1 (the boss) for Level 3
     return 0 # Default return
 
-# Main game loop
-def main():
-    start_screen() # Show start screen first
-    player = Player()
-    enemies = pygame.sprite.Group()
-    collectibles = pygame.sprite.Group() # Collectibles Group
-
-    current_level = 1 # Track current level
-    enemies_defeated_this_level = 0 # New: Counter for enemies defeated in current level
-    level_target_kills = load_level(current_level, enemies) # Load initial level and get target
-
-    enemy_escape_count = 0
-
-    collectible_spawn_timer = 0
-    COLLECTIBLE_SPAWN_RATE = 300 # Every 5 seconds (60 FPS * 5 seconds)
-
-    running = True
-    while running:
-        clock.tick(FPS) # Cap frame rate
-
-        # Read video frame for background
-        ret, frame = cap.read()
-        if not ret: # If video ends, loop it from the beginning
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            ret, frame = cap.read()
-        frame = cv2.resize(frame, (WIDTH, HEIGHT))
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        background_surface = pygame.surfarray.make_surface(np.rot90(frame))
-        win.blit(background_surface, (0, 0))
-
-        keys = pygame.key.get_pressed() # Get all currently pressed keys
+# Frame profiler. Phases are timed lap-style: each lap() charges the time since the
+# previous lap to the named phase, summed over every tick in the frame. F3 toggles an
+# overlay with rolling frame-time percentiles and the average cost of each phase, and
+# frames can be exported as CSV (one row per frame) or as a Chrome trace
+# (chrome://tracing, Perfetto). When neither is on, lap() returns straight away.
+PROFILE_WINDOW = 240 # Frames the overlay statistics cover
+PROFILE_OVERLAY_REFRESH = 15 # Frames between overlay redraws
+
+class FrameProfiler:
+    def __init__(self, window=PROFILE_WINDOW):
+        self.enabled = False
+        self.overlay_visible = False
+        self.exporting = False # Keep every frame for export, not just the rolling window
+        self.frame_times = collections.deque(maxlen=window)
+        self.phase_history = collections.deque(maxlen=window)
+        self.phase_names = {} # Every phase seen, in first-seen order
+        self.rows = [] # (frame seconds, phases) per frame, when exporting
+        self.events = [] # Chrome trace events, when exporting
+        self.phases = {}
+        self.t0 = time.perf_counter()
+        self.frame_start = self.last = self.t0
+        self.frames = 0
+        self.overlay = None
+
+    def set_overlay(self, visible):
+        self.overlay_visible = visible
+        self.enabled = visible or self.exporting
+
+    def start_export(self):
+        self.exporting = self.enabled = True
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.frame_start = self.last = time.perf_counter()
+        self.phases = {}
 
-        # Event handling
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_q):
-                running = False # End game loop
+    def lap(self, name):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self.last)
+        if self.exporting:
+            self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": 0,
+                                "ts": (self.last - self.t0) * 1e6, "dur": (now - self.last) * 1e6})
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        frame_time = time.perf_counter() - self.frame_start
+        self.frames += 1
+        self.frame_times.append(frame_time)
+        self.phase_history.append(self.phases)
+        for name in self.phases:
+            self.phase_names.setdefault(name, None)
+        if self.exporting:
+            self.rows.append((frame_time, self.phases))
+            self.events.append({"name": "frame", "ph": "X", "pid": os.getpid(), "tid": 0,
+                                "ts": (self.frame_start - self.t0) * 1e6, "dur": frame_time * 1e6,
+                                "args": {"frame": self.frames}})
+
+    def draw_overlay(self, surface):
+        if not self.overlay_visible or not self.frame_times:
+            return
+        if self.overlay is None or self.frames % PROFILE_OVERLAY_REFRESH == 0:
+            self.overlay = self.render_overlay()
+        surface.blit(self.overlay, (WIDTH - self.overlay.get_width() - 10, 40))
+
+    # Rendered straight with the font rather than render_text: these strings change
+    # every refresh and would only push the HUD text out of its cache
+    def render_overlay(self):
+        frame_ms = np.array(self.frame_times) * 1000
+        p50, p95, p99 = np.percentile(frame_ms, [50, 95, 99])
+        rows = [("frame ms", f"p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}  max {frame_ms.max():.2f}")]
+        frames = len(self.phase_history)
+        costs = []
+        for name in self.phase_names:
+            times = [phases.get(name, 0.0) for phases in self.phase_history]
+            costs.append((sum(times) / frames * 1000, max(times) * 1000, name))
+        for mean, worst, name in sorted(costs, reverse=True):
+            rows.append((name, f"{mean:.2f}  max {worst:.2f}"))
+        rendered = [(FONT.render(name, True, WHITE), FONT.render(value, True, WHITE)) for name, value in rows]
+        value_x = max(name.get_width() for name, _ in rendered) + 20 # Second column
+        line_height = FONT.get_linesize()
+        overlay = pygame.Surface((value_x + max(value.get_width() for _, value in rendered) + 10,
+                                  line_height * len(rendered) + 10), pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 170))
+        for row, (name, value) in enumerate(rendered):
+            overlay.blit(name, (5, 5 + row * line_height))
+            overlay.blit(value, (value_x, 5 + row * line_height))
+        return overlay
+
+    def export_csv(self, path):
+        names = list(self.phase_names)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "frame_ms"] + [f"{name}_ms" for name in names])
+            for frame, (frame_time, phases) in enumerate(self.rows, 1):
+                writer.writerow([frame, f"{frame_time * 1000:.3f}"]
+                                + [f"{phases.get(name, 0.0) * 1000:.3f}" for name in names])
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+profiler = FrameProfiler()
+
+# What Game.step can report back to the loop driving it
+LEVEL_COMPLETE = "level_complete"
+GAME_OVER = "game_over"
+BOSS_DEFEATED = "boss_defeated"
+
+COLLECTIBLE_SPAWN_RATE = 300 # Every 5 seconds (60 ticks * 5 seconds)
+
+# Key state for runs without a keyboard, indexable like pygame.key.get_pressed()
+class HeldKeys:
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+NO_KEYS = HeldKeys()
+
+# Recordings store one byte per tick: bit i set means RECORDED_KEYS[i] was held
+RECORDED_KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_w, pygame.K_SPACE)
+
+def pack_keys(keys):
+    bits = 0
+    for i, key in enumerate(RECORDED_KEYS):
+        if keys[key]:
+            bits |= 1 << i
+    return bits
+
+def unpack_keys(bits):
+    return HeldKeys(key for i, key in enumerate(RECORDED_KEYS) if bits & (1 << i))
+
+# Logs the key state of every simulation tick; saved as a JSON header line
+# followed by the zlib-compressed tick bytes
+class InputRecorder:
+    def __init__(self, path, seed):
+        self.path = path
+        self.seed = seed
+        self.ticks = bytearray()
+
+    def record(self, keys):
+        self.ticks.append(pack_keys(keys))
+
+    def save(self):
+        with open(self.path, "wb") as f:
+            f.write(json.dumps({"version": 1, "seed": self.seed, "tick_rate": TICK_RATE,
+                                "ticks": len(self.ticks)}).encode() + b"\n")
+            f.write(zlib.compress(bytes(self.ticks), 9))
+        print(f"Recorded {len(self.ticks)} ticks to {self.path}")
+
+# Returns (seed, key state per tick) from a file written by InputRecorder
+def load_recording(path):
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        ticks = zlib.decompress(f.read())
+    if header.get("version") != 1 or header.get("tick_rate") != TICK_RATE or len(ticks) != header.get("ticks"):
+        raise ValueError(f"{path} is not a recording this version of the game can replay")
+    states = [unpack_keys(bits) for bits in range(1 << len(RECORDED_KEYS))] # Shared, one per combination
+    return header["seed"], [states[bits] for bits in ticks]
+
+recorder = None # Set by --record
+
+# The play state: all entities and counters, advanced one fixed tick at a time.
+# One Game is reused for every play-through; reset() starts a new one in place.
+class Game:
+    def __init__(self):
+        self.player = Player()
+        self.enemies = pygame.sprite.Group()
+        self.collectibles = pygame.sprite.Group() # Collectibles Group
+        self.collectible_pool = [] # Every collectible made; dead ones get reused
+        self.reset()
+
+    def reset(self):
+        bullets.clear() # No bullets carry over from a previous game
+        self.player.reset()
+        self.collectibles.empty()
+
+        self.current_level = 1 # Track current level
+        self.enemies_defeated_this_level = 0 # New: Counter for enemies defeated in current level
+        self.level_target_kills = load_level(self.current_level, self.enemies) # Load initial level and get target
+
+        self.enemy_escape_count = 0
+        self.collectible_spawn_timer = 0
+        self.ticks = 0
+
+    # Advance the simulation by one tick; returns None or one of the outcomes above
+    def step(self, keys):
+        self.ticks += 1
+        player = self.player
 
         # Update game elements
         player.update(keys)
-        enemies.update()
-        collectibles.update()
+        self.enemies.update()
+        bullets.update() # Move and cull every bullet at once
+        self.collectibles.update()
+        profiler.lap("update")
 
         # Spawn collectibles
-        collectible_spawn_timer += 1
-        if collectible_spawn_timer >= COLLECTIBLE_SPAWN_RATE:
-            collectible_spawn_timer = 0
-            collectible_type = random.choice(['health_boost', 'extra_life', 'score_boost'])
-            new_collectible = Collectible(random.randint(50, WIDTH - 50), -30, collectible_type)
-            collectibles.add(new_collectible)
+        self.collectible_spawn_timer += 1
+        if self.collectible_spawn_timer >= COLLECTIBLE_SPAWN_RATE:
+            self.collectible_spawn_timer = 0
+            collectible_type = rng.choice(['health_boost', 'extra_life', 'score_boost'])
+            x = rng.randint(50, WIDTH - 50)
+            # Reuse one that was picked up or fell off screen, if any
+            new_collectible = next((item for item in self.collectible_pool if not item.alive()), None)
+            if new_collectible is None:
+                new_collectible = Collectible(x, -30, collectible_type)
+                self.collectible_pool.append(new_collectible)
+            else:
+                new_collectible.reset(x, -30, collectible_type)
+            self.collectibles.add(new_collectible)
+        profiler.lap("spawn")
+
+        # Bucket everything the player side can hit, once per tick
+        # (bullets are tested against the pool's arrays directly)
+        enemy_grid = SpatialHash()
+        collectible_grid = SpatialHash()
+        for enemy in self.enemies:
+            enemy_grid.insert(enemy)
+        for item in self.collectibles:
+            collectible_grid.insert(item)
+        profiler.lap("broadphase")
 
         # Collision between player and enemy bullets
-        for enemy in enemies:
-            for e_bullet in enemy.projectiles:
-                if player.rect.colliderect(e_bullet.rect):
-                    player.take_hit() # Player takes a hit
-                    e_bullet.kill() # Destroy enemy bullet
-                    if player.lives < 0: # If player runs out of lives
-                        game_over_screen()
-                        main() # Restart game (recursive call to main)
-                        return # Exit current main loop
+        for e_bullet in bullets.overlapping(player.rect, ENEMY_BULLET):
+            player.take_hit() # Player takes a hit
+            bullets.kill(e_bullet) # Destroy enemy bullet
+            if player.lives < 0: # If player runs out of lives
+                return GAME_OVER
+        profiler.lap("collide player/bullets")
 
         # Collision between player bullets and enemies
-        for shell in player.projectiles:
-            hit_list = pygame.sprite.spritecollide(shell, enemies, False) # False: don't kill enemy immediately
+        for shell in bullets.live(PLAYER_BULLET):
+            hit_list = enemy_grid.query(bullets.rect(shell)) # Enemies are not killed immediately
             for enemy in hit_list:
                 enemy.health -= 100 # Player bullet deals 100 damage
-                shell.kill() # Destroy player bullet on hit
+                bullets.kill(shell) # Destroy player bullet on hit
                 if enemy.health <= 0:
                     if enemy.boss:
-                        win_screen() # Show win screen if boss is defeated (game finished)
-                        main() # Restart game
-                        return # Exit current main loop
+                        return BOSS_DEFEATED # Game finished
                     player.score += 1 # Increase score for regular enemy
-                    enemies_defeated_this_level += 1 # New: Increment level enemy counter
+                    self.enemies_defeated_this_level += 1 # New: Increment level enemy counter
                     enemy.respawn() # Respawn defeated regular enemy
+        profiler.lap("collide shells/enemies")
 
         # Collision between player bullets and enemy bullets (optional, for deflecting/canceling)
-        for p_bullet in player.projectiles:
-            for enemy in enemies:
-                for e_bullet in enemy.projectiles:
-                    if pygame.sprite.collide_rect(p_bullet, e_bullet):
-                        p_bullet.kill() # Destroy both bullets on collision
-                        e_bullet.kill()
+        for p_bullet in bullets.live(PLAYER_BULLET):
+            e_bullets = bullets.overlapping(bullets.rect(p_bullet), ENEMY_BULLET)
+            if len(e_bullets):
+                bullets.kill(p_bullet) # Destroy both bullets on collision
+                bullets.kill(e_bullets)
+        profiler.lap("collide bullets/bullets")
 
         # Collision between player and collectibles
-        collected_items = pygame.sprite.spritecollide(player, collectibles, True) # True for auto-kill collectible
+        collected_items = collectible_grid.query(player.rect)
         for item in collected_items:
-            collect_sound.play() # Play sound when collected
+            item.kill() # Remove the collected item
+            audio.play(COLLECT_SOUND) # Play sound when collected
             if item.type == 'health_boost':
                 player.heal(item.value) # Use new heal method
             elif item.type == 'extra_life':
                 player.add_life() # Use new add_life method
             elif item.type == 'score_boost':
                 player.score += item.value
+        profiler.lap("collide pickups")
 
-        # Enemy movement and respawn if off screen
-        for enemy in enemies:
-            enemy.projectiles.draw(win) # Draw enemy bullets
-            enemy.draw_health_bar(win) # Draw enemy health bar
+        # Respawn enemies that went off screen
+        for enemy in self.enemies:
             if enemy.rect.top > HEIGHT: # If enemy goes off screen
-                enemy_escape_count += 1
+                self.enemy_escape_count += 1
                 enemy.respawn() # Respawn the escaped enemy
-                if enemy_escape_count >= 6 or player.lives < 0: # If too many enemies escape or player has no lives left
-                    game_over_screen()
-                    main() # Restart game
-                    return # Exit current main loop
+                if self.enemy_escape_count >= 6 or player.lives < 0: # If too many enemies escape or player has no lives left
+                    return GAME_OVER
+
+        profiler.lap("escapes")
 
         # --- New: Level Progression Logic ---
-        if current_level < 3 and enemies_defeated_this_level >= level_target_kills:
-            level_complete_screen(current_level) # Show "Level Complete" message
-            current_level += 1 # Advance to next level
-            enemies_defeated_this_level = 0 # Reset counter for next level
-            level_target_kills = load_level(current_level, enemies) # Load next level enemies and get its target
-
-        # Draw all elements
-        player.projectiles.draw(win) # Draw player bullets
-        win.blit(player.image, player.rect) # Draw player
-        enemies.draw(win) # Draw enemies
-        collectibles.draw(win) # Draw collectibles
-        draw_hud(player, enemy_escape_count, current_level) # Pass current_level to head up display(hud)
+        if self.current_level < 3 and self.enemies_defeated_this_level >= self.level_target_kills:
+            return LEVEL_COMPLETE
+        return None
+
+    def next_level(self):
+        self.current_level += 1 # Advance to next level
+        self.enemies_defeated_this_level = 0 # Reset counter for next level
+        self.level_target_kills = load_level(self.current_level, self.enemies) # Load next level enemies and get its target
+
+    # Draw the game alpha of the way between the previous tick and the current one
+    def draw(self, surface, alpha):
+        bullets.draw(surface, ENEMY_BULLET, alpha) # Draw enemy bullets
+        for enemy in self.enemies:
+            enemy.draw_health_bar(surface, interpolated(enemy, alpha)) # Draw enemy health bar
+        bullets.draw(surface, PLAYER_BULLET, alpha) # Draw player bullets
+        surface.blit(self.player.image, interpolated(self.player, alpha)) # Draw player
+        for group in (self.enemies, self.collectibles): # Draw enemies, then collectibles
+            surface.blits([(sprite.image, interpolated(sprite, alpha)) for sprite in group], doreturn=False)
+        profiler.lap("draw")
+        draw_hud(self.player, self.enemy_escape_count, self.current_level) # Pass current_level to head up display(hud)
+        profiler.lap("hud")
+
+# States of the main loop
+START = "start"
+PLAYING = "playing"
+QUIT = "quit"
+
+# Play until something interrupts the game: fixed simulation ticks, rendering as
+# often as the display allows. Returns the state to go to next.
+def play(game, first_frame_since=None):
+    accumulator = 0.0 # Real time not yet simulated
+    clock.tick() # Time spent on the previous screen doesn't count
+
+    while True:
+        profiler.begin_frame()
+        accumulator += min(clock.tick(FPS) / 1000, MAX_FRAME_SECONDS) # Cap frame rate
+        profiler.lap("wait")
+
+        # Event handling
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_q):
+                return QUIT # End game loop
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.set_overlay(not profiler.overlay_visible) # Toggle the profiler overlay
+
+        keys = pygame.key.get_pressed() # Get all currently pressed keys
+        profiler.lap("input")
+
+        # Run as many fixed ticks as the elapsed time calls for
+        while accumulator >= TICK_SECONDS:
+            accumulator -= TICK_SECONDS
+            if recorder is not None:
+                recorder.record(keys)
+            outcome = game.step(keys)
+            if outcome is not None:
+                return outcome # LEVEL_COMPLETE, GAME_OVER or BOSS_DEFEATED
+
+        # Draw the next prefetched video frame as the background, then the game on top
+        background.draw(win)
+        profiler.lap("video")
+        game.draw(win, accumulator / TICK_SECONDS)
+        profiler.draw_overlay(win)
+        profiler.lap("overlay")
 
         pygame.display.update() # Update the display
+        profiler.lap("display update")
+        profiler.end_frame()
+        if first_frame_since is not None:
+            report_first_frame("game", first_frame_since)
+
+# Main game loop: a state machine over the screens and the game itself. Restarts
+# reuse the same Game and its entities instead of starting over recursively.
+def main(bake=False):
+    global background
+    if win is None:
+        init_game()
+    # Images and sounds load while the start screen waits for a key
+    assets.preload([PLAYER_IMAGE, ENEMY_IMAGE, BOSS_IMAGE],
+                   list(SOUND_SETTINGS) if audio.enabled else []) # Decoded ahead so play() never waits
+    if background is None:
+        background = open_background(bake)
+    game = None
+    first_frame_since = None
+    state = START
+    while state != QUIT:
+        if state == START:
+            start_screen() # Show start screen first
+            if game is None:
+                first_frame_since = time.perf_counter() # Time from the key press to the first game frame
+                game = Game()
+            else:
+                game.reset()
+            state = PLAYING
+        elif state == PLAYING:
+            state = play(game, first_frame_since)
+        elif state == LEVEL_COMPLETE:
+            level_complete_screen(game.current_level) # Show "Level Complete" message
+            game.next_level()
+            state = PLAYING
+        elif state == GAME_OVER:
+            game_over_screen() # Returns when the player chose to restart
+            state = START
+        elif state == BOSS_DEFEATED:
+            win_screen() # Show win screen if boss is defeated (game finished)
+            state = START
 
     pygame.quit() # Quit pygame
     sys.exit() # Exit the system
 
+# Drive the game from a fixed sequence of key states, one per tick, with nobody at
+# the keyboard: level-complete screens are skipped and every game over or boss kill
+# simply starts a new game. Returns the time each tick took (including drawing,
+# when render is set), the number of games played and the game still running.
+def run_unattended(key_states, render=False):
+    if render:
+        global background
+        if background is None:
+            background = open_background()
+    game = Game()
+    games = 1
+    frame_times = []
+    for keys in key_states:
+        start = time.perf_counter()
+        profiler.begin_frame()
+        outcome = game.step(keys)
+        if outcome == LEVEL_COMPLETE:
+            game.next_level()
+        elif outcome is not None:
+            game.reset()
+            games += 1
+        if render:
+            pygame.event.pump() # Keep the window responsive
+            background.draw(win)
+            profiler.lap("video")
+            game.draw(win, 1.0)
+            pygame.display.update()
+            profiler.lap("display update")
+        profiler.end_frame()
+        frame_times.append(time.perf_counter() - start)
+    return frame_times, games, game
+
+def print_run_report(frame_times, games, game):
+    elapsed = sum(frame_times)
+    p50, p90, p99 = np.percentile(np.array(frame_times) * 1000, [50, 90, 99])
+    print(f"{len(frame_times)} ticks in {elapsed:.2f}s ({len(frame_times) / elapsed:.0f} ticks/s), {games} games played")
+    print(f"Frame time ms: p50 {p50:.3f}  p90 {p90:.3f}  p99 {p99:.3f}  max {max(frame_times) * 1000:.3f}")
+    print(f"Final state: level {game.current_level}, score {game.player.score}, lives {game.player.lives}, "
+          f"hits {game.player.hits_taken}, escaped {game.enemy_escape_count}")
+
+# Step the simulation as fast as the CPU allows, with no window, video or sound
+def run_headless(ticks, keys=NO_KEYS):
+    print_run_report(*run_unattended(itertools.repeat(keys, ticks)))
+
+# Restart the game over and over like a long kiosk session would, tracking the
+# Python heap. Returns how much it grew between the first and last checkpoints.
+SOAK_TICKS_PER_GAME = 300
+SOAK_KEYS = HeldKeys([pygame.K_SPACE, pygame.K_RIGHT]) # Keeps bullets and collisions busy
+SOAK_MAX_GROWTH_BYTES = 1024 * 1024 # More than this over a soak counts as a leak
+
+def run_soak(restarts, ticks_per_game=SOAK_TICKS_PER_GAME):
+    game = Game()
+    report_every = max(1, restarts // 10)
+    tracemalloc.start()
+    baseline = None
+    for restart in range(1, restarts + 1):
+        for _ in range(ticks_per_game):
+            outcome = game.step(SOAK_KEYS)
+            if outcome == LEVEL_COMPLETE:
+                game.next_level()
+            elif outcome is not None:
+                break
+        game.reset() # The same transition main() makes after game over or a win
+        if restart % report_every == 0:
+            current, peak = tracemalloc.get_traced_memory()
+            if baseline is None:
+                baseline = current
+            print(f"{restart:>7} restarts: heap {current / 1024:8.1f} KiB, peak {peak / 1024:8.1f} KiB")
+    tracemalloc.stop()
+    growth = current - baseline
+    print(f"Heap growth after the first checkpoint: {growth / 1024:.1f} KiB")
+    return growth
+
+# Play back a recording as a repeatable benchmark, headless or rendered
+def replay(path, render=False):
+    seed, key_states = load_recording(path)
+    rng.seed(seed)
+    print_run_report(*run_unattended(key_states, render))
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Space Battle")
+    parser.add_argument("--bake", action="store_true",
+                        help="decode the background video once into a raw frame store and play from it")
+    parser.add_argument("--no-sound", action="store_true",
+                        help="turn off music and sound effects")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the simulation with no window, video or sound, as fast as possible")
+    parser.add_argument("--ticks", type=int, default=100000,
+                        help="number of simulation ticks for --headless (default: %(default)s)")
+    parser.add_argument("--soak", type=int, metavar="RESTARTS",
+                        help="headless soak test: restart the game RESTARTS times and check memory stays flat")
+    parser.add_argument("--profile-csv", metavar="FILE",
+                        help="write per-frame, per-phase timings to FILE as CSV on exit")
+    parser.add_argument("--profile-trace", metavar="FILE",
+                        help="write per-phase timings to FILE as a Chrome trace on exit")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for enemy and collectible placement (default: random)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the seed and every tick's key state to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play back a recording and report frame-time percentiles "
+                             "(rendered, or as fast as possible with --headless)")
+    args = parser.parse_args()
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    rng.seed(seed)
+    init_game(headless=args.headless or bool(args.soak), sound=not args.no_sound)
+    if args.profile_csv or args.profile_trace:
+        profiler.start_export()
+    if args.record:
+        recorder = InputRecorder(args.record, seed)
+    status = 0
+    try:
+        if args.replay:
+            replay(args.replay, render=not args.headless)
+        elif args.soak:
+            growth = run_soak(args.soak)
+            status = 1 if growth > SOAK_MAX_GROWTH_BYTES else 0
+        elif args.headless:
+            run_headless(args.ticks)
+        else:
+            main(bake=args.bake)
+    finally:
+        # Also when the game exits from one of its screens
+        if recorder is not None:
+            recorder.save()
+        if args.profile_csv:
+            profiler.export_csv(args.profile_csv)
+        if args.profile_trace:
+            profiler.export_chrome_trace(args.profile_trace)
+    pygame.quit()
+    sys.exit(status)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules under test live at the repository root, next to their Input folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
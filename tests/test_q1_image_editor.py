@@ -0,0 +1,225 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import q1_image_editor as editor
+
+
+def make_image(h=61, w=83, channels=3, dtype=np.uint8, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (h, w) if channels == 1 else (h, w, channels)
+    if dtype == np.float32:
+        return rng.random(shape, dtype=np.float32)
+    return rng.integers(0, np.iinfo(dtype).max, shape, dtype=dtype, endpoint=True)
+
+
+def apply_all(img, ops):
+    for op in ops:
+        img = editor.apply_op(img, op)
+    return img
+
+
+@pytest.mark.parametrize("ops", [
+    [("rotate", 90)] * 4,
+    [("rotate", 90), ("rotate", 180), ("grayscale",)],
+    [("rotate", 360), ("grayscale",), ("grayscale",)],
+    [("crop", 5, 4, 70, 50), ("crop", 3, 2, 40, 30)],
+    [("crop", 5, 4, 70, 50), ("crop", 10, 10, 200, 200)],
+    [("crop", 2, 2, 60, 40), ("rotate", 90), ("crop", 1, 1, 20, 30), ("rotate", 270)],
+    [("blur", 5), ("blur", 3), ("resize", 50)],
+])
+def test_fuse_ops_matches_applying_ops_one_by_one(ops):
+    img = make_image()
+    assert np.array_equal(apply_all(img, editor.fuse_ops(ops)), apply_all(img, ops))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.float32])
+@pytest.mark.parametrize("channels", [1, 3])
+def test_compress_frame_round_trips(dtype, channels):
+    img = make_image(channels=channels, dtype=dtype)
+    restored = editor.decompress_frame(editor.compress_frame(img))
+    assert restored.dtype == img.dtype
+    assert np.array_equal(restored, img)
+
+
+# Bigger than one tile both ways, with partial tiles at the right and bottom edges
+TILED_SHAPE = (editor.TILE_SIZE + 301, 2 * editor.TILE_SIZE + 77)
+
+
+@pytest.mark.parametrize("op", [
+    ("grayscale",),
+    ("blur", 15),
+    ("rotate", 90),
+    ("rotate", 180),
+    ("rotate", 270),
+    ("rotate", 0),
+    ("crop", 100, 900, 2000, 1300),
+    ("resize", 37),
+])
+@pytest.mark.parametrize("channels", [1, 3])
+def test_tiled_ops_match_in_memory_ops(op, channels):
+    img = make_image(*TILED_SHAPE, channels=channels)
+    name, *args = op
+    expected = editor.OPERATIONS[name](img, *args)
+    assert np.array_equal(editor.TILED_OPERATIONS[name](img, *args), expected)
+
+
+def test_tiled_halve_matches_area_resize():
+    img = make_image(TILED_SHAPE[0] - 1, TILED_SHAPE[1] - 1)  # Even after dropping the odd edge
+    h, w = img.shape[0] // 2, img.shape[1] // 2
+    expected = cv2.resize(img[:2 * h, :2 * w], (w, h), interpolation=cv2.INTER_AREA)
+    assert np.array_equal(editor.tiled_halve(img), expected)
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / "photo.png"
+    cv2.imwrite(str(path), make_image())
+    return str(path)
+
+
+def open_session(image_file, root, **kwargs):
+    journal = editor.SessionJournal.for_image(image_file, root=str(root))
+    for name, value in kwargs.items():
+        setattr(journal, name, value)
+    graph = editor.EditGraph(editor.read_image(image_file), journal=journal)
+    journal.restore(graph)
+    return journal, graph
+
+
+def test_session_journal_restores_history(image_file, tmp_path):
+    journal, graph = open_session(image_file, tmp_path / "sessions")
+    for op in [("rotate", 90), ("grayscale",), ("blur", 5), ("rotate", 90), ("crop", 2, 2, 40, 30)]:
+        graph.push(op)
+        graph.evaluate()
+    graph.undo()
+    graph.undo()
+    graph.redo()
+    expected_ops, expected_redo = graph.ops(), [node.op for node in graph.redo_stack]
+    expected_image = graph.evaluate()
+    journal.close()
+
+    journal, restored = open_session(image_file, tmp_path / "sessions")
+    assert restored.ops() == expected_ops
+    assert [node.op for node in restored.redo_stack] == expected_redo
+    assert journal.has_keyframe(editor.JOURNAL_KEYFRAME_INTERVAL - 1)  # Written by the first session
+    assert np.array_equal(restored.evaluate(), expected_image)
+    restored.redo()
+    assert np.array_equal(restored.evaluate(), apply_all(editor.read_image(image_file), restored.ops()))
+    journal.close()
+
+
+def test_session_journal_drops_unreachable_keyframes(image_file, tmp_path):
+    journal, graph = open_session(image_file, tmp_path / "sessions", keyframe_interval=1)
+    for _ in range(4):
+        graph.push(("rotate", 90))
+        graph.evaluate()
+    graph.undo()
+    graph.undo()
+    graph.push(("grayscale",))
+    graph.evaluate()
+    assert sorted(journal.saved) == sorted(graph.reachable_serials())
+    journal.close()
+
+
+def test_prune_sessions_keeps_open_sessions(tmp_path):
+    root = tmp_path / "sessions"
+    journals = []
+    for i in range(editor.JOURNAL_MAX_SESSIONS + 5):
+        path = tmp_path / f"{i}.png"
+        path.write_bytes(bytes(i + 1))  # Distinct sizes, so distinct sessions
+        journals.append(editor.SessionJournal.for_image(str(path), root=str(root)))
+    assert all(os.path.isdir(journal.directory) for journal in journals)
+    for journal in journals:
+        journal.close()
+    editor.prune_sessions(str(root), 3)
+    assert len(os.listdir(root)) == 3
+
+
+def test_session_journal_recovers_edits_after_a_torn_line(image_file, tmp_path):
+    journal, graph = open_session(image_file, tmp_path / "sessions")
+    graph.push(("rotate", 90))
+    graph.push(("grayscale",))
+    journal.close()
+    with open(journal.log_path, "a") as f:
+        f.write('{"action": "pu')  # Crash in the middle of a write
+
+    journal, graph = open_session(image_file, tmp_path / "sessions")
+    assert graph.ops() == [("rotate", 90), ("grayscale",)]
+    graph.push(("blur", 5))
+    graph.push(("rotate", 90))
+    journal.close()
+
+    journal, graph = open_session(image_file, tmp_path / "sessions")
+    assert graph.ops() == [("rotate", 90), ("grayscale",), ("blur", 5), ("rotate", 90)]
+    journal.close()
+
+
+@pytest.mark.parametrize("ops", [
+    [],
+    [("rotate", 90)],
+    [("rotate", 180), ("grayscale",)],
+    [("rotate", 270), ("grayscale",)],
+    [("crop", 10, 5, 70, 50)],
+    [("crop", 10, 5, 70, 50), ("rotate", 90), ("crop", 3, 8, 40, 50)],
+])
+def test_map_rect_follows_the_edits(ops):
+    # Mark a region of the original, apply the edits and crop the mapped rectangle:
+    # every marked pixel that survived the edits must be inside it, and nothing else
+    img = np.zeros((61, 83), np.uint8)
+    img[20:45, 15:60] = 255
+    edited = apply_all(img, ops)
+    rect = editor.map_rect((15, 20, 60, 45), 83, 61, ops)
+    x0, y0, x1, y1 = rect
+    assert edited[y0:y1, x0:x1].all()
+    assert np.count_nonzero(edited) == (x1 - x0) * (y1 - y0)
+
+
+def test_map_rect_rejects_regions_cut_away():
+    assert editor.map_rect((50, 0, 83, 61), 83, 61, [("crop", 0, 0, 40, 61)]) is None
+    assert editor.map_rect((0, 0, 83, 61), 83, 61, [("rotate", 90)]) == (0, 0, 61, 83)
+
+
+def rotations(img, graph):
+    # The pixels the head should have after only 90 degree rotations
+    turns = graph.head.depth + 1 if graph.head is not None else 0
+    return editor.op_rotate(img, 90 * turns)
+
+
+@pytest.mark.parametrize("smooth", [True, False])
+def test_history_budget_keeps_raw_then_compresses_then_drops(smooth):
+    if smooth:  # Compresses to almost nothing
+        img = np.broadcast_to(np.arange(100, dtype=np.uint8)[None, :, None], (100, 100, 3)).copy()
+    else:  # Doesn't compress at all
+        img = make_image(100, 100)
+    graph = editor.EditGraph(img, budget_bytes=3 * img.nbytes + 100, hot_results=2)
+    for _ in range(3):
+        graph.push(("rotate", 90))
+        graph.evaluate()
+    # Under budget: everything stays raw
+    assert len(graph.memo) == 3
+    assert all(isinstance(value, np.ndarray) for value in graph.memo.values())
+
+    for _ in range(3):
+        graph.push(("rotate", 90))
+        graph.evaluate()
+    assert graph.nbytes <= graph.budget_bytes
+    assert graph.nbytes == sum(editor.frame_nbytes(value) for value in graph.memo.values())
+    values = list(graph.memo.values())
+    assert all(isinstance(value, np.ndarray) for value in values[-2:])  # The hot results
+    if smooth:
+        # Older results were compressed rather than dropped
+        assert len(graph.memo) == 6
+        assert not any(isinstance(value, np.ndarray) for value in values[:-2])
+    else:
+        # Compressing doesn't help, so the oldest were dropped
+        assert len(graph.memo) < 6
+
+    while graph.undo():
+        assert np.array_equal(graph.evaluate(), rotations(img, graph))
+    assert np.array_equal(graph.evaluate(), img)
+    while graph.redo():
+        assert np.array_equal(graph.evaluate(), rotations(img, graph))
+    assert graph.nbytes <= graph.budget_bytes
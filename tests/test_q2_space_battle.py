@@ -0,0 +1,57 @@
+import random
+
+import pygame
+import pytest
+
+import q2_space_battle as game_module
+
+
+@pytest.fixture(scope="module", autouse=True)
+def headless_game():
+    game_module.init_game(headless=True)
+    yield
+    pygame.quit()
+
+
+def test_bullet_pool_overlapping_matches_colliderect():
+    rnd = random.Random(1)
+    pool = game_module.BulletPool(256)
+    for _ in range(200):
+        pool.spawn(rnd.randint(-20, game_module.WIDTH + 20), rnd.randint(-20, game_module.HEIGHT + 20),
+                   rnd.choice([-1, 1]), rnd.choice([game_module.PLAYER_BULLET, game_module.ENEMY_BULLET]))
+    pool.update()  # Moves some off screen, which frees them
+    for _ in range(300):
+        rect = pygame.Rect(rnd.randint(-50, game_module.WIDTH), rnd.randint(-50, game_module.HEIGHT),
+                           rnd.randint(0, 120), rnd.randint(0, 120))
+        for kind in (game_module.PLAYER_BULLET, game_module.ENEMY_BULLET):
+            expected = [slot for slot in pool.live(kind) if rect.colliderect(pool.rect(slot))]
+            assert pool.overlapping(rect, kind).tolist() == expected
+
+
+def final_state(game):
+    return (game.current_level, game.player.score, game.player.lives, game.player.hits_taken,
+            game.enemy_escape_count, game.player.rect.topleft,
+            sorted(enemy.rect.topleft for enemy in game.enemies),
+            sorted(item.rect.topleft for item in game.collectibles),
+            game_module.bullets.active.tobytes(), game_module.bullets.y.tobytes())
+
+
+def test_replaying_a_recording_twice_gives_the_same_game(tmp_path):
+    path = str(tmp_path / "run.rec")
+    recorder = game_module.InputRecorder(path, seed=1234)
+    rnd = random.Random(5)
+    held = []
+    for _ in range(1500):
+        if rnd.random() < 0.05:  # Change keys every now and then, like a player would
+            held = rnd.sample(game_module.RECORDED_KEYS, rnd.randint(0, 3))
+        recorder.record(game_module.HeldKeys(held))
+    recorder.save()
+
+    states = []
+    for _ in range(2):
+        seed, key_states = game_module.load_recording(path)
+        game_module.rng.seed(seed)
+        game_module.bullets.clear()
+        _, games, game = game_module.run_unattended(key_states)
+        states.append((games, final_state(game)))
+    assert states[0] == states[1]